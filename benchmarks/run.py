@@ -0,0 +1,156 @@
+from standins import iris, mattermost, openai, vault
+from standins.base import Faults
+import argparse
+import tempfile
+import logging
+import random
+import math
+import json
+import time
+import sys
+import os
+
+SECRETS = {'secret/data/iris': {'token': 'iris'},
+           'secret/data/mattermost': {'key': 'mattermost'},
+           'secret/data/gpt': {'key': 'gpt'}}
+
+def percentile(samples, fraction) -> float:
+    """ Nearest-rank percentile of a list of samples """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+def write_config(directory, servers, args) -> None:
+    """ Point every backend configuration at the stand-in servers """
+    os.makedirs(os.path.join(directory, 'configuration'), exist_ok=True)
+    url = lambda name: "http://127.0.0.1:{0}".format(servers[name].server_port)
+    configs = {
+        'vault': {'fqdn': url('vault'), 'token': 'stand-in', 'buffer': 3600,
+                  'iris_token_path': 'secret/data/iris',
+                  'mattermost_token_path': 'secret/data/mattermost',
+                  'gpt_token_path': 'secret/data/gpt'},
+        'iris': {'fqdn': url('iris'), 'customer': '1', 'workers': args.workers,
+                 'refresh_interval': 0, 'close_rate': 0, 'cluster_duplicates': args.duplicates > 0},
+        'mattermost': {'fqdn': url('mattermost'), 'channel': 'bench', 'username': 'triage', 'user_id': 'bot',
+                       'channel_id': 'channel', 'team_id': 'team', 'polling_interval': 1, 'stream': False},
+        'gpt': {'model': 'stand-in', 'modality': ['text'], 'effort': 'medium', 'role': 'developer',
+                'content': 'Summarize: ', 'n': 1, 'api_url': url('openai') + '/v1', 'workers': args.workers,
+                'fast_model': args.fast_model, 'strong_model': 'stand-in'},
+        'transport': {'retries': 3, 'backoff_factor': 0.05},
+        'metrics': {'enabled': False},
+    }
+    for name, config in configs.items():
+        with open(os.path.join(directory, 'configuration', name + '.yaml'), 'w') as f:
+            json.dump({name: config}, f)
+
+def start_standins(args, cases) -> dict:
+    faults = lambda: Faults(args.latency, args.jitter, args.failure_rate, args.throttle_rate, retry_after=0, seed=1)
+    states = {
+        'vault': vault.VaultState(secrets=SECRETS),
+        'iris': iris.IrisState(cases, evidence=args.evidence, iocs=args.iocs, duplicates=args.duplicates),
+        'mattermost': mattermost.MattermostState(),
+        'openai': openai.OpenAIState(latency=args.gpt_latency, investigate_rate=args.investigate_rate),
+    }
+    servers = {
+        'vault': vault.start(states['vault'], faults()),
+        'iris': iris.start(states['iris'], faults()),
+        'mattermost': mattermost.start(states['mattermost'], faults()),
+        'openai': openai.start(states['openai'], faults()),
+    }
+    return states, servers
+
+def bench_command(bot, states, command, cases, args) -> dict:
+    """ Drive one command through MattermostMethods.handle_command and time each run """
+    samples = []
+    for run in range(args.runs):
+        states['mattermost'].clear()
+        if command == 'list':
+            started = time.perf_counter()
+            bot.handle_command('cases', ['list'])
+        elif command == 'iocs':
+            case_id = str(random.randint(1, cases))
+            started = time.perf_counter()
+            bot.handle_command('cases', ['iocs', case_id])
+        elif command == 'related':
+            case_id = str(random.randint(1, cases))
+            started = time.perf_counter()
+            bot.handle_command('cases', ['related', case_id])
+        elif command == 'ioc-lookup':
+            started = time.perf_counter()
+            bot.handle_command('iocs', ['lookup', '198.51.100.0/24'])
+        elif command == 'annotate-all':
+            if not args.warm_cache:
+                bot.iris.g.cache.memory.clear()
+            started = time.perf_counter()
+            bot.handle_command('cases', ['annotate', 'all'])
+        elif command == 'close-all':
+            states['iris'].reopen()
+            bot.iris.sync_cases(full=True)
+            started = time.perf_counter()
+            bot.handle_command('cases', ['close', 'all'])
+        samples.append(time.perf_counter() - started)
+    bulk = command in ('annotate-all', 'close-all')
+    total = sum(samples)
+    return {
+        'command': command,
+        'cases': cases,
+        'runs': len(samples),
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'throughput': (cases * len(samples) if bulk else len(samples)) / total if total else 0.0,
+        'unit': 'cases/s' if bulk else 'ops/s',
+        'posts': len(states['mattermost'].bot_posts()),
+    }
+
+def run(args) -> list:
+    results = []
+    home = os.getcwd()
+    for cases in args.cases:
+        states, servers = start_standins(args, cases)
+        with tempfile.TemporaryDirectory() as directory:
+            write_config(directory, servers, args)
+            os.chdir(directory)
+            try:
+                from methods.container import Container
+                logging.getLogger().setLevel(logging.WARNING)
+                bot = Container().mattermost
+                for command in args.commands:
+                    result = bench_command(bot, states, command, cases, args)
+                    results.append(result)
+                    print("{command:<13} {cases:>6} cases  runs={runs:<3} p50={p50_ms:9.1f}ms  "
+                          "p99={p99_ms:9.1f}ms  {throughput:10.1f} {unit}  posts/run={posts}".format(**result))
+            finally:
+                os.chdir(home)
+        for server in servers.values():
+            server.shutdown()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark bot commands against local IRIS, Mattermost, Vault and OpenAI stand-ins")
+    parser.add_argument('--cases', default='10,100,1000', help="comma-separated dataset sizes (10 to 10000)")
+    parser.add_argument('--commands', default='list,iocs,related,ioc-lookup,annotate-all,close-all')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--evidence', type=int, default=5, help="evidence items per case")
+    parser.add_argument('--iocs', type=int, default=10, help="IOCs per case")
+    parser.add_argument('--duplicates', type=float, default=0.0, help="fraction of cases that repeat an earlier case's evidence")
+    parser.add_argument('--latency', type=float, default=0.005, help="stand-in response latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--gpt-latency', type=float, default=0.05, help="extra latency per completion in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of stand-in calls answered with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of stand-in calls answered with 429")
+    parser.add_argument('--fast-model', default='', help="route small cases to this model, escalating to 'stand-in'")
+    parser.add_argument('--investigate-rate', type=float, default=0.0, help="fraction of completions recommending investigation")
+    parser.add_argument('--warm-cache', action='store_true', help="keep GPT completions cached between annotate runs")
+    parser.add_argument('--json', default='', help="also write results to this file")
+    args = parser.parse_args()
+    args.cases = [int(n) for n in args.cases.split(',')]
+    args.commands = args.commands.split(',')
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
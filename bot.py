@@ -1,22 +1,44 @@
-from methods import mattermost
+from methods.container import Container
+from methods import metrics
+import logging
 import time
-import sys
 
 class Bot():
 
     def __init__(self):
-        self.m = mattermost.MattermostMethods()
+        metrics.serve_from_config()
+        self.container = Container()
+        self.m = self.container.mattermost
+
+    def poll(self):
+        started = time.monotonic()
+        if self.m.events_connected():
+            self.m.process_events(self.m.polling_interval)
+        else:
+            self.m.process_mentions()
+        self.last_poll = time.monotonic()
+        metrics.poll_duration.observe(self.last_poll - started)
+        if not self.m.events_connected():
+            time.sleep(self.m.polling_interval)
 
     def run(self):
-        try:
-            self.m.post_message("Security triage bot online")
-            while True:
-                self.m.process_mentions()
-                time.sleep(self.m.polling_interval)
-        except Exception as e:
-            self.m.post_message(f"Error: {e}")
-            sys.exit()
+        self.m.post_message("Security triage bot online")
+        self.container.warm('iris', 'scheduler')
+        self.last_poll = time.monotonic()
+        metrics.poll_lag.set_function(lambda: time.monotonic() - self.last_poll)
+        failures = 0
+        while True:
+            try:
+                self.poll()
+                failures = 0
+            except Exception as e:
+                # Stay up through backend outages: report once, then back off and keep polling
+                failures += 1
+                logging.exception("Poll loop error: {0}".format(e))
+                if failures == 1:
+                    self.m.post_message(f"Error: {e}")
+                time.sleep(min(60, max(1, self.m.polling_interval) * 2 ** min(failures, 6)))
 
 if __name__ == '__main__':
     b = Bot()
-    b.run()
\ No newline at end of file
+    b.run()
@@ -0,0 +1,81 @@
+from methods import metrics
+import requests
+import threading
+import logging
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ Raised instead of calling a backend whose circuit is open """
+
+class CircuitBreaker():
+    """ Stops calling a backend after repeated failures, then lets single probes through to detect recovery """
+
+    def __init__(self, name, failure_threshold=5, recovery_time=30):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_time = recovery_time
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.last_error = ''
+        self.probing = False
+        self.lock = threading.Lock()
+        metrics.circuit_state.set(0, backend=name)
+
+    def transition(self, state) -> None:
+        self.state = state
+        metrics.circuit_state.set(STATE_VALUES[state], backend=self.name)
+
+    def allow(self) -> bool:
+        """ Whether a call may go out now; in half-open state only one probe at a time is let through """
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_time:
+                self.transition(HALF_OPEN)
+                logging.info("Circuit for {0} half-open, probing".format(self.name))
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state != CLOSED:
+                logging.info("Circuit for {0} closed, backend recovered".format(self.name))
+                self.transition(CLOSED)
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self, error='') -> None:
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logging.error("Circuit for {0} open after {1} failures: {2}".format(self.name, self.failures, error))
+                self.transition(OPEN)
+                self.opened_at = time.monotonic()
+
+    def available(self) -> bool:
+        """ Whether the next call would go out: closed, or due for a recovery probe """
+        with self.lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.recovery_time
+            return self.state == CLOSED or not self.probing
+
+    def describe(self) -> dict:
+        with self.lock:
+            return {
+                'backend': self.name,
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in': max(0, int(self.recovery_time - (time.monotonic() - self.opened_at))) if self.state == OPEN else 0,
+                'last_error': self.last_error,
+            }
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+class LRUCache():
+    """ Thread-safe, size-bounded LRU mapping with an optional per-entry TTL """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+class DiskCache():
+    """ SQLite-backed key/value store with TTL and size-based LRU eviction """
+
+    def __init__(self, path, ttl=None, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS cache ("
+                            "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, created = row
+            if self.ttl and created + self.ttl < now:
+                self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return default
+            self.db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            return json.loads(value)
+
+    def set(self, key, value) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                            (key, json.dumps(value), now, now))
+            if self.ttl:
+                self.db.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+            count = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute("DELETE FROM cache WHERE key IN "
+                                "(SELECT key FROM cache ORDER BY accessed LIMIT ?)", (count - self.max_entries,))
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM cache WHERE key = ?", (key,))
+        return value
+
+class TieredCache():
+    """ In-memory LRU in front of an optional on-disk tier """
+
+    def __init__(self, maxsize=256, path='', ttl=None, max_entries=10000):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(path, ttl=ttl, max_entries=max_entries) if path else None
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return default if value is None else value
+
+    def set(self, key, value) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def pop(self, key, default=None):
+        value = self.memory.pop(key)
+        if self.disk is not None:
+            disk_value = self.disk.pop(key)
+            value = disk_value if value is None else value
+        return default if value is None else value
+
+def digest(*parts) -> str:
+    """ Stable content hash of JSON-serialisable parts, used as a cache key """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
@@ -0,0 +1,52 @@
+from methods.vault import VaultMethods
+from methods.gpt import GPTMethods
+from methods.iris import IrisMethods
+from methods.mattermost import MattermostMethods
+from methods.scheduler import Scheduler
+import threading
+import logging
+
+class Container():
+    """ Builds each backend client once, on first use, around a single shared Vault client """
+
+    def __init__(self):
+        self.instances = {}
+        self.lock = threading.RLock()
+
+    def get(self, name, factory):
+        with self.lock:
+            if name not in self.instances:
+                self.instances[name] = factory()
+            return self.instances[name]
+
+    @property
+    def vault(self) -> VaultMethods:
+        return self.get('vault', VaultMethods)
+
+    @property
+    def gpt(self) -> GPTMethods:
+        return self.get('gpt', lambda: GPTMethods(vault=self.vault))
+
+    @property
+    def iris(self) -> IrisMethods:
+        return self.get('iris', lambda: IrisMethods(vault=self.vault, gpt_factory=lambda: self.gpt))
+
+    @property
+    def mattermost(self) -> MattermostMethods:
+        return self.get('mattermost', lambda: MattermostMethods(vault=self.vault, iris_factory=lambda: self.iris))
+
+    @property
+    def scheduler(self) -> Scheduler:
+        return self.get('scheduler', lambda: Scheduler(self.iris, notify=self.mattermost.post_message))
+
+    def warm(self, *names) -> threading.Thread:
+        """ Build backends on a background thread so the first command does not pay for them """
+        def build():
+            for name in names:
+                try:
+                    getattr(self, name)
+                except Exception as e:
+                    logging.exception("Failed to initialize {0}".format(name))
+        thread = threading.Thread(target=build, name="warm", daemon=True)
+        thread.start()
+        return thread
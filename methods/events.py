@@ -0,0 +1,103 @@
+import threading
+import logging
+import queue
+import json
+import ssl
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+class MattermostEvents():
+    """ Listens for Mattermost WebSocket 'posted' events on a background thread """
+
+    def __init__(self, url, token, channel_id, verify=False, ping_interval=30, max_reconnect_delay=60):
+        self.url = url
+        self.token = token
+        self.channel_id = channel_id
+        self.verify = verify
+        self.ping_interval = ping_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.posts = queue.Queue()
+        self.connected = threading.Event()
+        self.resync = threading.Event()
+        self.stopped = threading.Event()
+        self.connection_id = ''
+        self.sequence = -1
+        self.thread = None
+
+    def available(self) -> bool:
+        return websocket is not None
+
+    def start(self) -> bool:
+        """ Start the listener thread """
+        if not self.available():
+            logging.error("websocket-client is not installed, falling back to polling")
+            return False
+        self.thread = threading.Thread(target=self.run, name="mattermost-events", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run(self) -> None:
+        """ Keep a WebSocket session open, reconnecting with exponential backoff """
+        delay = 1
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as e:
+                logging.error("Mattermost WebSocket disconnected: {0}".format(e))
+            if self.connected.is_set():
+                delay = 1
+            self.connected.clear()
+            if self.stopped.wait(delay):
+                break
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def listen(self) -> None:
+        url = self.url
+        if self.connection_id:
+            url += "?connection_id={0}&sequence_number={1}".format(self.connection_id, self.sequence + 1)
+        sslopt = {} if self.verify else {'cert_reqs': ssl.CERT_NONE, 'check_hostname': False}
+        ws = websocket.create_connection(url,
+                                         header=["Authorization: Bearer {0}".format(self.token)],
+                                         sslopt=sslopt,
+                                         timeout=self.ping_interval)
+        try:
+            ws.send(json.dumps({
+                'seq': 1,
+                'action': 'authentication_challenge',
+                'data': {'token': self.token}
+            }))
+            while not self.stopped.is_set():
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    ws.ping()
+                    continue
+                if not raw:
+                    raise ConnectionError("connection closed by server")
+                self.handle_event(json.loads(raw))
+        finally:
+            ws.close()
+
+    def handle_event(self, message) -> None:
+        if 'event' not in message:
+            return
+        if 'seq' in message:
+            self.sequence = message['seq']
+        if message['event'] == 'hello':
+            connection_id = message.get('data', {}).get('connection_id', '')
+            if self.connection_id and connection_id != self.connection_id:
+                # The server could not resume the old session, so events were missed
+                self.resync.set()
+            self.connection_id = connection_id
+            self.connected.set()
+            logging.info("Mattermost WebSocket connected")
+        elif message['event'] == 'posted':
+            post = json.loads(message.get('data', {}).get('post', '{}'))
+            if post.get('channel_id') == self.channel_id:
+                self.posts.put(post)
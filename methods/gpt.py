@@ -1,21 +1,74 @@
 from methods.vault import VaultMethods
-import requests
+from methods.cache import TieredCache, digest
+from methods.index import severity_rank
+from methods import transport
+from methods import metrics
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+import threading
 import logging
 import json
+import time
 import yaml
 import sys
+import re
 import os
 
+CHARS_PER_TOKEN = 4
+RECOMMENDATION = re.compile(r'recommendation\W*\s*(close|investigate)', re.IGNORECASE)
+
+def estimate_tokens(text) -> int:
+    """ Rough local token estimate, close enough for budgeting requests """
+    return (len(str(text)) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def parse_recommendation(text):
+    """ The close/investigate verdict from a completion's recommendation line, or None """
+    match = RECOMMENDATION.search(str(text or ''))
+    return match.group(1).lower() if match else None
+
 class GPTMethods():
 
-    def __init__(self):
-        v = VaultMethods()
+    def __init__(self, vault=None):
+        self.http = transport.client('gpt')
+        v = vault or VaultMethods()
         token = v.retrieve_gpt_secrets()
         self.headers = {
             'Authorization': 'Bearer {0}'.format(token),
             'Content-Type': 'application/json'
         }
+        v.watch('gpt', v.gpt_token_path, 'key', self.set_api_key)
+        self.cache_size = 256
+        self.cache_path = ''
+        self.cache_ttl = 604800
+        self.cache_max_entries = 10000
+        self.context_budget = 12000
+        self.chunk_tokens = 6000
+        self.chunk_prompt = "Summarize the security-relevant facts in this evidence excerpt. Keep hostnames, users, IPs, hashes and timestamps. "
+        self.workers = 4
+        self.api_url = 'https://api.openai.com/v1'
+        self.batch_dir = 'batches'
+        self.batch_poll_interval = 60
+        self.batch_timeout = 86400
+        self.completion_allowance = 500
+        self.fast_model = ''
+        self.strong_model = ''
+        self.route_max_tokens = 2000
+        self.route_severity = 'high'
+        self.escalate_on = ['investigate', None]
+        self.reasoning_models = ['o1', 'o3', 'o4', 'gpt-5']
+        self.stats = defaultdict(lambda: {'requests': 0, 'seconds': 0.0, 'prompt_tokens': 0,
+                                          'completion_tokens': 0, 'escalations': 0})
+        self.stats_lock = threading.Lock()
         self.load_config()
+        self.cache = TieredCache(maxsize=self.cache_size,
+                                 path=self.cache_path,
+                                 ttl=self.cache_ttl,
+                                 max_entries=self.cache_max_entries)
+
+    def set_api_key(self, key) -> dict:
+        """ Swap in a rotated OpenAI API key """
+        self.headers['Authorization'] = 'Bearer {0}'.format(key)
+        return {'Authorization': self.headers['Authorization']}
 
     def load_config(self) -> None:
         """ Load GPT configuration """
@@ -31,6 +84,26 @@ class GPTMethods():
                     self.role = config['role']
                     self.content = config['content']
                     self.n = config['n']
+                    self.cache_size = config.get('cache_size', self.cache_size)
+                    self.cache_path = config.get('cache_path', self.cache_path)
+                    self.cache_ttl = config.get('cache_ttl', self.cache_ttl)
+                    self.cache_max_entries = config.get('cache_max_entries', self.cache_max_entries)
+                    self.context_budget = config.get('context_budget', self.context_budget)
+                    self.chunk_tokens = config.get('chunk_tokens', self.chunk_tokens)
+                    self.chunk_prompt = config.get('chunk_prompt', self.chunk_prompt)
+                    self.workers = config.get('workers', self.workers)
+                    self.api_url = config.get('api_url', self.api_url).rstrip('/')
+                    self.batch_dir = config.get('batch_dir', self.batch_dir)
+                    self.batch_poll_interval = config.get('batch_poll_interval', self.batch_poll_interval)
+                    self.batch_timeout = config.get('batch_timeout', self.batch_timeout)
+                    self.completion_allowance = config.get('completion_allowance', self.completion_allowance)
+                    self.fast_model = config.get('fast_model', self.fast_model)
+                    self.strong_model = config.get('strong_model', self.strong_model) or self.model
+                    self.route_max_tokens = config.get('route_max_tokens', self.route_max_tokens)
+                    self.route_severity = config.get('route_severity', self.route_severity)
+                    self.escalate_on = [None if verdict == 'unparseable' else verdict
+                                        for verdict in config.get('escalate_on', ['investigate', 'unparseable'])]
+                    self.reasoning_models = config.get('reasoning_models', self.reasoning_models)
         except Exception as e:
             logging.exception("Failed to load GPT configuration")
             sys.exit(1)
@@ -38,7 +111,7 @@ class GPTMethods():
     def list_models(self):
         """ List available GPT models """
         try:
-            response = requests.get(url="https://api.openai.com/v1/models",
+            response = self.http.get(url="{0}/models".format(self.api_url),
                                     headers=self.headers)
             models = response.json()['data']
             for model in models:
@@ -47,24 +120,334 @@ class GPTMethods():
             logging.exception("Error listing models: {0}".format(e))
             return None
         
-    def create_completion(self, prompt) -> str:
+    def build_messages(self, prompt, content=None) -> list:
+        """ Build the chat messages for a single request """
+        return [{
+            'role': self.role,
+            'content': (self.content if content is None else content) + str(prompt),
+        }]
+
+    def completion_key(self, prompt, content=None, model=None) -> str:
+        """ Cache key for a completion: model, system prompt and evidence """
+        return digest(model or self.model, self.content if content is None else content, str(prompt))
+
+    def is_reasoning_model(self, model) -> bool:
+        return any(model == prefix or model.startswith(prefix + '-') for prefix in self.reasoning_models)
+
+    def completion_payload(self, prompt, content=None, model=None) -> dict:
+        payload = {
+            "model": model or self.model,
+            'messages': self.build_messages(prompt, content),
+            'n': self.n,
+            'modalities': self.modality,
+        }
+        if self.is_reasoning_model(payload['model']):
+            payload['reasoning_effort'] = self.effort
+        return payload
+
+    def route(self, evidence, severity=None) -> str:
+        """ Pick the model for evidence: the fast model for small routine cases, else the strong model """
+        if not self.fast_model:
+            return self.model
+        if estimate_tokens(evidence) > self.route_max_tokens:
+            return self.strong_model
+        threshold = severity_rank(self.route_severity)
+        if severity is not None and threshold is not None and severity >= threshold:
+            return self.strong_model
+        return self.fast_model
+
+    def record_usage(self, model, usage) -> None:
+        """ Count prompt and completion tokens reported by the API """
+        if not usage:
+            return
+        metrics.gpt_tokens.inc(usage.get('prompt_tokens', 0), model=model, kind='prompt')
+        metrics.gpt_tokens.inc(usage.get('completion_tokens', 0), model=model, kind='completion')
+        with self.stats_lock:
+            self.stats[model]['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            self.stats[model]['completion_tokens'] += usage.get('completion_tokens', 0)
+
+    def record_latency(self, model, seconds) -> None:
+        metrics.gpt_latency.observe(seconds, model=model)
+        with self.stats_lock:
+            self.stats[model]['requests'] += 1
+            self.stats[model]['seconds'] += seconds
+
+    def model_stats(self) -> list:
+        """ Per-model request count, mean latency, token usage and escalations since startup """
+        with self.stats_lock:
+            return [(model, stats['requests'],
+                     stats['seconds'] / stats['requests'] if stats['requests'] else 0.0,
+                     stats['prompt_tokens'], stats['completion_tokens'], stats['escalations'])
+                    for model, stats in sorted(self.stats.items())]
+
+    def request_tokens(self, payload) -> int:
+        """ Token budget to reserve for a request: the prompt plus an allowance for the reply """
+        prompt_tokens = sum(estimate_tokens(message['content']) for message in payload['messages'])
+        return prompt_tokens + self.completion_allowance
+
+    def create_completion(self, prompt, content=None, model=None) -> str:
         """ Generate completion using the GPT cmopletion endpoint """
         try:
-            self.content += prompt
-            payload = {
-                "model": self.model,
-                'messages':[ {
-                    'role': self.role,
-                    'content': self.content,
-                }],
-                'n': self.n,
-                'modalities': self.modality,
-            }
-            response = requests.post(url="https://api.openai.com/v1/chat/completions",
+            key = self.completion_key(prompt, content, model)
+            completion = self.cache.get(key)
+            if completion is not None:
+                logging.info("Completion cache hit")
+                return completion
+            payload = self.completion_payload(prompt, content, model)
+            started = time.perf_counter()
+            response = self.http.post(url="{0}/chat/completions".format(self.api_url),
                                     headers=self.headers,
-                                    data=json.dumps(payload))
-            completion = response.json()['choices'][0]['message']['content']
+                                    data=json.dumps(payload),
+                                    tokens=self.request_tokens(payload))
+            self.record_latency(payload['model'], time.perf_counter() - started)
+            body = response.json()
+            self.record_usage(payload['model'], body.get('usage'))
+            completion = body['choices'][0]['message']['content']
+            if completion:
+                self.cache.set(key, completion)
             return completion
         except Exception as e:
             logging.exception("Error creating completion: {0}".format(e))
-            return None
\ No newline at end of file
+            return None
+
+    def stream_completion(self, prompt, on_delta, content=None, model=None) -> str:
+        """ Generate a completion over the SSE stream, passing the text so far to on_delta """
+        try:
+            key = self.completion_key(prompt, content, model)
+            completion = self.cache.get(key)
+            if completion is not None:
+                on_delta(completion)
+                return completion
+            payload = self.completion_payload(prompt, content, model)
+            started = time.perf_counter()
+            payload['stream'] = True
+            payload['stream_options'] = {'include_usage': True}
+            response = self.http.post(url="{0}/chat/completions".format(self.api_url),
+                                      headers=self.headers,
+                                      data=json.dumps(payload),
+                                      tokens=self.request_tokens(payload),
+                                      stream=True)
+            if response.status_code != 200:
+                logging.error("Streaming completion failed: {0} - {1}".format(response.status_code, response.text))
+                return None
+            completion = ''
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                self.record_usage(payload['model'], chunk.get('usage'))
+                choices = chunk.get('choices') or [{}]
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    completion += delta
+                    on_delta(completion)
+            response.close()
+            self.record_latency(payload['model'], time.perf_counter() - started)
+            if completion:
+                self.cache.set(key, completion)
+            return completion or None
+        except Exception as e:
+            logging.exception("Error streaming completion: {0}".format(e))
+            return None
+
+    def chunk_evidence(self, evidence) -> list:
+        """ Split evidence on line boundaries into chunks that fit the chunk token budget """
+        limit = self.chunk_tokens * CHARS_PER_TOKEN
+        chunks = []
+        current = ''
+        for line in str(evidence).splitlines(keepends=True):
+            while len(line) > limit:
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.append(line[:limit])
+                line = line[limit:]
+            if len(current) + len(line) > limit:
+                chunks.append(current)
+                current = ''
+            current += line
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def escalation_reason(self, completion):
+        """ Why a fast-model completion must be redone on the strong model, or None if it can stand """
+        if not completion:
+            return 'failed'
+        verdict = parse_recommendation(completion) or 'unparseable'
+        return verdict if verdict in self.escalate_on else None
+
+    def record_escalation(self, model, reason) -> None:
+        logging.info("Escalating to {0}: fast model verdict {1}".format(self.strong_model, reason))
+        metrics.gpt_escalations.inc(reason=reason)
+        with self.stats_lock:
+            self.stats[model]['escalations'] += 1
+
+    def complete(self, evidence, on_delta=None, model=None) -> str:
+        if on_delta:
+            return self.stream_completion(evidence, on_delta, model=model)
+        return self.create_completion(evidence, model=model)
+
+    def annotate(self, evidence, on_delta=None, severity=None) -> str:
+        """ Complete evidence on the routed model, escalating ambiguous fast-model verdicts to the strong model.
+            Both models stream to on_delta, so an escalated answer replaces the fast one as it arrives. """
+        model = self.route(evidence, severity)
+        completion = self.complete(evidence, on_delta, model)
+        if model != self.fast_model or self.fast_model == self.strong_model:
+            return completion
+        reason = self.escalation_reason(completion)
+        if reason is None:
+            return completion
+        self.record_escalation(model, reason)
+        if on_delta and completion:
+            on_delta("Fast model verdict was {0}, re-running on {1}...".format(reason, self.strong_model))
+        return self.complete(evidence, on_delta, self.strong_model)
+
+    def summarize_evidence(self, evidence, on_delta=None, severity=None) -> str:
+        """ Annotate evidence, map-reducing it through chunk summaries when it exceeds the context budget """
+        try:
+            while estimate_tokens(evidence) > self.context_budget:
+                chunks = self.chunk_evidence(evidence)
+                logging.info("Summarizing evidence in {0} chunks".format(len(chunks)))
+                model = self.fast_model or self.model
+                with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+                    summaries = list(pool.map(lambda chunk: self.create_completion(chunk, self.chunk_prompt, model), chunks))
+                if any(summary is None for summary in summaries):
+                    return None
+                reduced = '\n'.join(summaries)
+                if estimate_tokens(reduced) >= estimate_tokens(evidence):
+                    logging.error("Evidence summaries did not shrink the evidence")
+                    return None
+                evidence = reduced
+            return self.annotate(evidence, on_delta, severity)
+        except Exception as e:
+            logging.exception("Error summarizing evidence: {0}".format(e))
+            return None
+
+    def create_batch(self, prompts, models=None) -> str:
+        """ Write prompts ({custom_id: prompt}) to a JSONL file and submit it to the Batch API """
+        try:
+            os.makedirs(self.batch_dir, exist_ok=True)
+            path = os.path.join(self.batch_dir, "batch-{0}.jsonl".format(int(time.time())))
+            with open(path, 'w') as f:
+                for custom_id, prompt in prompts.items():
+                    f.write(json.dumps({
+                        'custom_id': str(custom_id),
+                        'method': 'POST',
+                        'url': '/v1/chat/completions',
+                        'body': self.completion_payload(prompt, model=(models or {}).get(custom_id)),
+                    }) + '\n')
+            auth = {'Authorization': self.headers['Authorization']}
+            with open(path, 'rb') as f:
+                content = f.read()
+            response = self.http.post(url="{0}/files".format(self.api_url),
+                                      headers=auth,
+                                      data={'purpose': 'batch'},
+                                      files={'file': (os.path.basename(path), content)})
+            input_file_id = response.json()['id']
+            payload = {
+                'input_file_id': input_file_id,
+                'endpoint': '/v1/chat/completions',
+                'completion_window': '24h',
+            }
+            response = self.http.post(url="{0}/batches".format(self.api_url),
+                                      headers=self.headers,
+                                      data=json.dumps(payload))
+            batch_id = response.json()['id']
+            logging.info("Submitted batch {0} with {1} requests".format(batch_id, len(prompts)))
+            return batch_id
+        except Exception as e:
+            logging.exception("Error creating batch: {0}".format(e))
+            return None
+
+    def wait_for_batch(self, batch_id, cancelled=None) -> dict:
+        """ Poll a batch until it reaches a terminal state """
+        deadline = time.monotonic() + self.batch_timeout
+        while time.monotonic() < deadline:
+            try:
+                response = self.http.get(url="{0}/batches/{1}".format(self.api_url, batch_id),
+                                         headers=self.headers)
+                batch = response.json()
+                if batch['status'] in ('completed', 'failed', 'expired', 'cancelled'):
+                    return batch
+            except Exception as e:
+                logging.exception("Error polling batch {0}: {1}".format(batch_id, e))
+            if cancelled and cancelled():
+                self.http.post(url="{0}/batches/{1}/cancel".format(self.api_url, batch_id),
+                               headers=self.headers)
+                return None
+            time.sleep(self.batch_poll_interval)
+        logging.error("Batch {0} did not finish in time".format(batch_id))
+        return None
+
+    def get_batch_results(self, batch) -> dict:
+        """ Download a finished batch's output file and map custom_id to completion """
+        results = {}
+        try:
+            if not batch.get('output_file_id'):
+                return results
+            response = self.http.get(url="{0}/files/{1}/content".format(self.api_url, batch['output_file_id']),
+                                     headers=self.headers)
+            for line in response.text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                result = item.get('response') or {}
+                if result.get('status_code') == 200:
+                    self.record_usage(result['body'].get('model', self.model), result['body'].get('usage'))
+                    results[item['custom_id']] = result['body']['choices'][0]['message']['content']
+        except Exception as e:
+            logging.exception("Error retrieving batch results: {0}".format(e))
+        return results
+
+    def run_batch(self, prompts, cancelled=None, severities=None) -> dict:
+        """ Complete prompts through the Batch API, routing each by size and severity; fast-model verdicts
+            that need escalation are redone on the strong model in a follow-up batch """
+        severities = {str(custom_id): severity for custom_id, severity in (severities or {}).items()}
+        models = {str(custom_id): self.route(prompt, severities.get(str(custom_id))) for custom_id, prompt in prompts.items()}
+        results = self.submit_batch(prompts, models, cancelled)
+        if not self.fast_model or self.fast_model == self.strong_model or (cancelled and cancelled()):
+            return results
+        escalations = {}
+        for custom_id, prompt in prompts.items():
+            completion = results.get(str(custom_id))
+            if models[str(custom_id)] != self.fast_model or completion is None:
+                continue
+            reason = self.escalation_reason(completion)
+            if reason is not None:
+                self.record_escalation(self.fast_model, reason)
+                escalations[custom_id] = prompt
+                # Never let an ambiguous fast verdict through if the strong model does not answer
+                del results[str(custom_id)]
+        if escalations:
+            results.update(self.submit_batch(escalations,
+                                             {str(custom_id): self.strong_model for custom_id in escalations},
+                                             cancelled))
+        return results
+
+    def submit_batch(self, prompts, models, cancelled=None) -> dict:
+        """ Complete prompts on the given models ({custom_id: model}) in one batch, serving cached completions locally """
+        results = {}
+        pending = {}
+        for custom_id, prompt in prompts.items():
+            completion = self.cache.get(self.completion_key(prompt, model=models[str(custom_id)]))
+            if completion is not None:
+                results[str(custom_id)] = completion
+            else:
+                pending[str(custom_id)] = prompt
+        if not pending:
+            return results
+        batch_id = self.create_batch(pending, models)
+        if batch_id is None:
+            return results
+        batch = self.wait_for_batch(batch_id, cancelled)
+        if batch is None:
+            return results
+        for custom_id, completion in self.get_batch_results(batch).items():
+            if completion and custom_id in pending:
+                self.cache.set(self.completion_key(pending[custom_id], model=models[custom_id]), completion)
+                results[custom_id] = completion
+        return results
\ No newline at end of file
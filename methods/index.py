@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import datetime
+import threading
+import bisect
+import sqlite3
+import json
+import time
+
+def parse_date(value):
+    """ Parse the date formats IRIS uses for open dates """
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+# IRIS severity_id is a row in its severities table, not an ordinal, so rank by name instead
+SEVERITY_RANKS = {'unspecified': 0, 'informational': 1, 'low': 2, 'medium': 3, 'high': 4, 'critical': 5}
+
+def severity_rank(name):
+    """ Rank of an IRIS severity name, lowest first, or None if it is not a known severity """
+    return SEVERITY_RANKS.get(str(name or '').strip().lower())
+
+def normalize_case(case) -> dict:
+    """ Project an IRIS case from either the list or the filter endpoint onto the fields the bot uses """
+    state = case.get('state')
+    client = case.get('client')
+    open_date = case.get('case_open_date') or case.get('open_date') or ''
+    parsed = parse_date(open_date)
+    return {
+        'case_id': case.get('case_id'),
+        'case_name': case.get('case_name', case.get('name', '')),
+        'state_name': case.get('state_name') or (state or {}).get('state_name', ''),
+        'customer': str(case.get('customer_id') or case.get('client_id') or (client or {}).get('customer_id', '')),
+        'customer_name': case.get('client_name') or (client or {}).get('customer_name', ''),
+        'open_date': parsed.isoformat() if parsed else str(open_date),
+        'severity_id': case.get('severity_id') or (case.get('severity') or {}).get('severity_id'),
+        'severity_rank': severity_rank(case.get('severity_name') or (case.get('severity') or {}).get('severity_name')),
+    }
+
+class CaseIndex():
+    """ Local index of IRIS cases keyed by ID, state, customer and open date """
+
+    def __init__(self, path=''):
+        self.lock = threading.RLock()
+        self.cases = {}
+        self.by_state = defaultdict(set)
+        self.by_customer = defaultdict(set)
+        self.by_age = []
+        self.synced_at = 0
+        self.full_synced_at = 0
+        self.newest_open_date = ''
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS cases (case_id INTEGER PRIMARY KEY, data TEXT)")
+            for (data,) in self.db.execute("SELECT data FROM cases"):
+                self.put(json.loads(data), persist=False)
+
+    def put(self, case, persist=True) -> None:
+        """ Insert or replace a normalized case """
+        with self.lock:
+            self.remove(case['case_id'], persist=False)
+            case_id = case['case_id']
+            self.cases[case_id] = case
+            self.by_state[case['state_name']].add(case_id)
+            self.by_customer[case['customer']].add(case_id)
+            bisect.insort(self.by_age, (case['open_date'], case_id))
+            if case['open_date'] > self.newest_open_date:
+                self.newest_open_date = case['open_date']
+            if persist and self.db is not None:
+                with self.db:
+                    self.db.execute("INSERT OR REPLACE INTO cases (case_id, data) VALUES (?, ?)",
+                                    (case_id, json.dumps(case)))
+
+    def remove(self, case_id, persist=True) -> None:
+        with self.lock:
+            case = self.cases.pop(case_id, None)
+            if case is None:
+                return
+            self.by_state[case['state_name']].discard(case_id)
+            self.by_customer[case['customer']].discard(case_id)
+            position = bisect.bisect_left(self.by_age, (case['open_date'], case_id))
+            if position < len(self.by_age) and self.by_age[position] == (case['open_date'], case_id):
+                del self.by_age[position]
+            if persist and self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM cases WHERE case_id = ?", (case_id,))
+
+    def replace_open(self, cases) -> None:
+        """ Reconcile against a complete listing of open cases, dropping any that have closed """
+        cases = list(cases)
+        seen = {case['case_id'] for case in cases}
+        with self.lock:
+            for case_id in list(self.by_state.get('Open', ())):
+                if case_id not in seen:
+                    self.remove(case_id)
+            for case in cases:
+                self.put(case)
+            self.synced_at = self.full_synced_at = time.time()
+
+    def merge(self, cases) -> None:
+        """ Merge an incremental listing of new or changed cases """
+        # Drain the listing before locking so readers are not held up by paged IRIS calls
+        cases = list(cases)
+        with self.lock:
+            for case in cases:
+                if case['state_name'] == 'Open':
+                    self.put(case)
+                else:
+                    self.remove(case['case_id'])
+            self.synced_at = time.time()
+
+    def get(self, case_id):
+        with self.lock:
+            return self.cases.get(case_id)
+
+    def query(self, state='Open', customer=None, opened_before=None) -> list:
+        """ Return cases matching state, customer and open date, ordered by case ID """
+        with self.lock:
+            ids = set(self.by_state.get(state, ())) if state else set(self.cases)
+            if customer not in (None, ''):
+                ids &= self.by_customer.get(str(customer), set())
+            if opened_before is not None:
+                cutoff = bisect.bisect_left(self.by_age, (opened_before.isoformat(),))
+                ids &= {case_id for open_date, case_id in self.by_age[:cutoff]}
+            return [self.cases[case_id] for case_id in sorted(ids, key=lambda i: int(i))]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.cases)
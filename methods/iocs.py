@@ -0,0 +1,172 @@
+from collections import defaultdict
+import ipaddress
+import threading
+import bisect
+import sqlite3
+import time
+
+def parse_address(value):
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
+
+def parse_network(value):
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+def refang(value) -> str:
+    value = str(value).strip().strip('<>"\'').lower()
+    value = value.replace('[.]', '.').replace('(.)', '.').replace('[:]', ':')
+    if value.startswith('hxxp'):
+        value = 'http' + value[4:]
+    return value
+
+def normalize_ioc(value) -> str:
+    """ Canonical form of an IOC value: refanged, lowercased and, for addresses, compressed """
+    value = refang(value).rstrip('.')
+    address = parse_address(value)
+    return str(address) if address is not None else value
+
+class IOCIndex():
+    """ Inverted index from normalized IOC value to the open cases it appears in """
+
+    def __init__(self, path=''):
+        self.lock = threading.RLock()
+        self.cases_by_value = defaultdict(set)
+        self.values_by_case = {}
+        self.indexed_at = {}
+        self.values = []
+        self.addresses = {4: [], 6: []}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS ioc_cases (case_id INTEGER PRIMARY KEY, indexed_at REAL)")
+                self.db.execute("CREATE TABLE IF NOT EXISTS iocs (case_id INTEGER, value TEXT, PRIMARY KEY (case_id, value))")
+            values = defaultdict(list)
+            for case_id, value in self.db.execute("SELECT case_id, value FROM iocs"):
+                values[case_id].append(value)
+            for case_id, indexed_at in self.db.execute("SELECT case_id, indexed_at FROM ioc_cases"):
+                self.put(case_id, values[case_id], persist=False, indexed_at=indexed_at)
+
+    def add_value(self, value, case_id) -> None:
+        cases = self.cases_by_value[value]
+        if not cases:
+            bisect.insort(self.values, value)
+            address = parse_address(value)
+            if address is not None:
+                bisect.insort(self.addresses[address.version], (int(address), value))
+        cases.add(case_id)
+
+    def discard_value(self, value, case_id) -> None:
+        cases = self.cases_by_value.get(value)
+        if cases is None:
+            return
+        cases.discard(case_id)
+        if cases:
+            return
+        del self.cases_by_value[value]
+        position = bisect.bisect_left(self.values, value)
+        if position < len(self.values) and self.values[position] == value:
+            del self.values[position]
+        address = parse_address(value)
+        if address is not None:
+            addresses = self.addresses[address.version]
+            position = bisect.bisect_left(addresses, (int(address), value))
+            if position < len(addresses) and addresses[position] == (int(address), value):
+                del addresses[position]
+
+    def put(self, case_id, values, persist=True, indexed_at=None) -> None:
+        """ Replace the IOCs recorded for a case """
+        values = {normalize_ioc(value) for value in values if str(value).strip()}
+        with self.lock:
+            self.remove(case_id, persist=False)
+            for value in values:
+                self.add_value(value, case_id)
+            self.values_by_case[case_id] = values
+            self.indexed_at[case_id] = indexed_at or time.time()
+            if persist and self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM iocs WHERE case_id = ?", (case_id,))
+                    self.db.executemany("INSERT INTO iocs (case_id, value) VALUES (?, ?)",
+                                        [(case_id, value) for value in values])
+                    self.db.execute("INSERT OR REPLACE INTO ioc_cases (case_id, indexed_at) VALUES (?, ?)",
+                                    (case_id, self.indexed_at[case_id]))
+
+    def remove(self, case_id, persist=True) -> None:
+        with self.lock:
+            for value in self.values_by_case.pop(case_id, ()):
+                self.discard_value(value, case_id)
+            self.indexed_at.pop(case_id, None)
+            if persist and self.db is not None:
+                with self.db:
+                    self.db.execute("DELETE FROM iocs WHERE case_id = ?", (case_id,))
+                    self.db.execute("DELETE FROM ioc_cases WHERE case_id = ?", (case_id,))
+
+    def case_ids(self) -> set:
+        with self.lock:
+            return set(self.values_by_case)
+
+    def values_for(self, case_id) -> set:
+        with self.lock:
+            return set(self.values_by_case.get(case_id, ()))
+
+    def stale(self, case_ids, max_age) -> list:
+        """ Case IDs that have never been indexed or were indexed more than max_age seconds ago """
+        cutoff = time.time() - max_age
+        with self.lock:
+            return [case_id for case_id in case_ids if self.indexed_at.get(case_id, 0) <= cutoff]
+
+    def exact(self, value) -> dict:
+        value = normalize_ioc(value)
+        with self.lock:
+            cases = self.cases_by_value.get(value)
+            return {value: set(cases)} if cases else {}
+
+    def prefix(self, prefix) -> dict:
+        """ Every indexed value starting with prefix, found by bisecting the sorted value list """
+        prefix = refang(prefix)
+        with self.lock:
+            start = bisect.bisect_left(self.values, prefix)
+            end = bisect.bisect_left(self.values, prefix + '\uffff')
+            return {value: set(self.cases_by_value[value]) for value in self.values[start:end]}
+
+    def within(self, network) -> dict:
+        """ Every indexed address inside a CIDR network """
+        with self.lock:
+            addresses = self.addresses[network.version]
+            start = bisect.bisect_left(addresses, (int(network.network_address), ''))
+            end = bisect.bisect_right(addresses, (int(network.broadcast_address), '\uffff'))
+            return {value: set(self.cases_by_value[value]) for _, value in addresses[start:end]}
+
+    def lookup(self, query) -> dict:
+        """ Map matching IOC values to case IDs; 'value*' is a prefix search and 'a.b.c.d/n' a CIDR search """
+        query = str(query).strip()
+        if query.endswith('*'):
+            return self.prefix(query[:-1])
+        if '/' in query:
+            network = parse_network(query)
+            if network is not None:
+                return self.within(network)
+        return self.exact(query)
+
+    def related(self, case_id) -> dict:
+        """ Map every other case to the IOC values it shares with case_id """
+        shared = defaultdict(set)
+        with self.lock:
+            for value in self.values_by_case.get(case_id, ()):
+                for other in self.cases_by_value[value]:
+                    if other != case_id:
+                        shared[other].add(value)
+        return dict(shared)
+
+    def __contains__(self, case_id) -> bool:
+        with self.lock:
+            return case_id in self.values_by_case
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.cases_by_value)
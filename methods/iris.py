@@ -1,11 +1,21 @@
 from methods.vault import VaultMethods
-from methods.gpt import GPTMethods
+from methods.gpt import GPTMethods, estimate_tokens
+from methods.index import CaseIndex, normalize_case
+from methods.iocs import IOCIndex
+from methods import similarity
+from methods import jsonstream
+from methods.cache import LRUCache
+from methods.ratelimit import TokenBucket
+from methods import transport
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from random import randint
-import requests
+import threading
 import logging
 import urllib3
 import json
 import yaml
+import time
 import sys
 import os
 
@@ -16,12 +26,30 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 class IrisMethods():
 
-    def __init__(self):
-        v = VaultMethods()
-        self.g = GPTMethods()
+    def __init__(self, vault=None, gpt_factory=None):
+        self.http = transport.client('iris')
+        v = vault or VaultMethods()
+        self.gpt = None
+        self.gpt_factory = gpt_factory or (lambda: GPTMethods(vault=v))
+        self.gpt_lock = threading.Lock()
         self.cms = ''
         self.cases = []
         self.customer = ''
+        self.workers = 4
+        self.index_path = ''
+        self.refresh_interval = 300
+        self.full_sync_interval = 1800
+        self.page_size = 200
+        self.note_cache_size = 1024
+        self.note_cache_ttl = 600
+        self.update_existing = True
+        self.close_rate = 5
+        self.ioc_index_path = ''
+        self.ioc_ttl = 3600
+        self.cluster_duplicates = False
+        self.similarity_threshold = 0.8
+        self.minhash_permutations = 64
+        self.lsh_bands = 8
         self.case_count = len(self.cases)
         self.load_config()
         self.cms_api_key = v.retrieve_iris_secrets()
@@ -29,7 +57,33 @@ class IrisMethods():
             'Content-Type':'application/json',
             'Authorization':'Bearer {0}'.format(self.cms_api_key)
         }
-    
+        v.watch('iris', v.iris_token_path, 'token', self.set_api_key)
+        self.index = CaseIndex(self.index_path)
+        self.note_cache = LRUCache(maxsize=self.note_cache_size, ttl=self.note_cache_ttl)
+        self.directory_ids = LRUCache(maxsize=self.note_cache_size)
+        self.note_ids = LRUCache(maxsize=self.note_cache_size)
+        self.close_limiter = TokenBucket(self.close_rate)
+        self.sync_lock = threading.Lock()
+        self.ioc_index = IOCIndex(self.ioc_index_path)
+        self.ioc_lock = threading.Lock()
+        self.minhasher = similarity.MinHasher(self.minhash_permutations)
+        if self.refresh_interval:
+            threading.Thread(target=self.refresh_index, name="iris-index", daemon=True).start()
+
+    @property
+    def g(self):
+        """ GPT client, created on the first command that needs it """
+        with self.gpt_lock:
+            if self.gpt is None:
+                self.gpt = self.gpt_factory()
+            return self.gpt
+
+    def set_api_key(self, key) -> dict:
+        """ Swap in a rotated IRIS API key """
+        self.cms_api_key = key
+        self.cms_headers['Authorization'] = 'Bearer {0}'.format(key)
+        return {'Authorization': self.cms_headers['Authorization']}
+
     def load_config(self):
         """ Load IRIS configuration """
         try:
@@ -38,19 +92,94 @@ class IrisMethods():
                 with open('configuration/iris.yaml', 'r') as f:
                     config = yaml.safe_load(f)
                     config = config['iris']
-                    self.cms = config['fqdn']
+                    self.cms = transport.base_url(config['fqdn'])
                     self.customer = config['customer']
+                    self.workers = config.get('workers', self.workers)
+                    self.index_path = config.get('index_path', self.index_path)
+                    self.refresh_interval = config.get('refresh_interval', self.refresh_interval)
+                    self.full_sync_interval = config.get('full_sync_interval', self.full_sync_interval)
+                    self.page_size = config.get('page_size', self.page_size)
+                    self.note_cache_size = config.get('note_cache_size', self.note_cache_size)
+                    self.note_cache_ttl = config.get('note_cache_ttl', self.note_cache_ttl)
+                    self.update_existing = config.get('update_existing', self.update_existing)
+                    self.close_rate = config.get('close_rate', self.close_rate)
+                    self.ioc_index_path = config.get('ioc_index_path', self.ioc_index_path)
+                    self.ioc_ttl = config.get('ioc_ttl', self.ioc_ttl)
+                    self.cluster_duplicates = config.get('cluster_duplicates', self.cluster_duplicates)
+                    self.similarity_threshold = config.get('similarity_threshold', self.similarity_threshold)
+                    self.minhash_permutations = config.get('minhash_permutations', self.minhash_permutations)
+                    self.lsh_bands = config.get('lsh_bands', self.lsh_bands)
         except Exception as e:
             logging.exception("Failed to load iris configuration")
             sys.exit(1)
 
+    def fetch_cases(self, **filters):
+        """ Yield normalized open cases for the configured customer, filtered server-side """
+        params = {'is_open': 'true', 'per_page': self.page_size, 'page': 1}
+        if self.customer:
+            params['case_customer_id'] = self.customer
+        params.update(filters)
+        while True:
+            response = self.http.get(url="{0}/manage/cases/filter".format(self.cms),
+                                     headers=self.cms_headers,
+                                     params=params,
+                                     stream=True,
+                                     verify=False)
+            if response.status_code in (404, 405):
+                response.close()
+                break
+            # Anything else is an outage, not a missing endpoint; keep the cached index instead of falling back
+            response.raise_for_status()
+            page = {}
+            for case in jsonstream.iter_response(response, ['data', 'cases'], page):
+                case = normalize_case(case)
+                if not case['customer']:
+                    case['customer'] = str(self.customer)
+                if not case['state_name']:
+                    case['state_name'] = 'Open'
+                yield case
+            if not page.get('next_page'):
+                return
+            params['page'] = page['next_page']
+        # Older IRIS releases have no filter endpoint, so fall back to the full listing
+        logging.info("Case filter unavailable ({0}), using the full case list".format(response.status_code))
+        response = self.http.get(url="{0}/manage/cases/list".format(self.cms),
+                                 headers=self.cms_headers,
+                                 stream=True,
+                                 verify=False)
+        response.raise_for_status()
+        for case in jsonstream.iter_response(response, ['data']):
+            if case['state_name'] == 'Open':
+                yield normalize_case(case)
+
+    def sync_cases(self, full=False) -> bool:
+        """ Bring the case index up to date, incrementally unless a full reconcile is due """
+        with self.sync_lock:
+            try:
+                full = full or not self.index.full_synced_at or \
+                    time.time() - self.index.full_synced_at > self.full_sync_interval
+                if full:
+                    self.index.replace_open(self.fetch_cases())
+                else:
+                    since = self.index.newest_open_date[:10]
+                    self.index.merge(self.fetch_cases(start_open_date=since))
+                return True
+            except Exception as e:
+                logging.exception("Error synchronizing cases: {0}".format(e))
+                return False
+
+    def refresh_index(self) -> None:
+        """ Keep the case and IOC indexes fresh in the background """
+        while True:
+            self.sync_cases()
+            self.index_iocs()
+            time.sleep(self.refresh_interval)
+
     def get_open_cases(self) -> None:
         try:
-            response = requests.get(url="https://{0}/manage/cases/list".format(self.cms),
-                                    headers=self.cms_headers,
-                                    verify=False)
-            cases = response.json()['data']
-            self.cases = [case for case in cases if case['state_name'] == 'Open']
+            if not self.index.synced_at or time.time() - self.index.synced_at > max(self.refresh_interval, 1):
+                self.sync_cases()
+            self.cases = self.index.query(state='Open')
             self.case_count = len(self.cases)
         except Exception as e:
             logging.exception("Error retrieving cases: {0}".format(e))
@@ -59,11 +188,13 @@ class IrisMethods():
     def close_case(self, case_id) -> None:
         """ Close single DFIR IRIS case """
         try:
-            response = requests.post(url="https://{0}/manage/cases/close/{1}".format(self.cms,case_id),
+            response = self.http.post(url="{0}/manage/cases/close/{1}".format(self.cms,case_id),
                                      headers=self.cms_headers,
                                      verify=False)
             if response.status_code == 200:
                 logging.info("Case {0} closed".format(case_id))
+                self.index.remove(int(case_id))
+                self.ioc_index.remove(int(case_id))
                 return True
             else:
                 logging.info("Failed to close {0}".format(case_id))
@@ -72,21 +203,57 @@ class IrisMethods():
             logging.exception("Error closing case: {0}".format(e))
             return False
         
-    def close_all_cases(self) -> None:
-        """ Close all cases in DFIR IRIS """
+    def close_all_cases(self, progress=None, cancelled=None) -> dict:
+        """ Close all open cases in DFIR IRIS """
+        return self.close_cases(self.select_cases(), progress=progress, cancelled=cancelled)
+
+    def select_cases(self, case_ids=None, id_range=None, older_than_days=None, customer=None) -> list:
+        """ Select case IDs to operate on by explicit IDs, an inclusive ID range, age in days or customer """
+        # An explicit ID list, even an empty one, is never widened to every open case
+        if case_ids is not None:
+            return [int(case_id) for case_id in case_ids]
         self.get_open_cases()
-        try:
-            for case in self.cases:
-                self.close_case(case['case_id'])
-            return True
-        except Exception as e:
-            return False
+        opened_before = datetime.now() - timedelta(days=int(older_than_days)) if older_than_days else None
+        cases = self.index.query(state='Open', customer=customer, opened_before=opened_before)
+        selected = [int(case['case_id']) for case in cases]
+        if id_range:
+            low, high = id_range
+            selected = [case_id for case_id in selected if low <= case_id <= high]
+        return selected
+
+    def close_cases(self, case_ids, dry_run=False, progress=None, cancelled=None) -> dict:
+        """ Close cases concurrently under the IRIS rate limit, returning a result per case """
+        results = {}
+        if dry_run or not case_ids:
+            return results
+        workers = max(1, min(int(self.workers), len(case_ids)))
+
+        def close(case_id):
+            if cancelled and cancelled():
+                return None
+            self.close_limiter.acquire()
+            return self.close_case(case_id)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(close, case_id): case_id for case_id in case_ids}
+            for future in as_completed(futures):
+                case_id = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.exception("Error closing case {0}: {1}".format(case_id, e))
+                    result = False
+                if result is not None:
+                    results[case_id] = result
+                if progress:
+                    progress(len(results), len(case_ids))
+        return results
 
     def create_notes_directory(self, case_id, directory_name) -> str:
         """ Creates a note directory for case notes """
         try:
             payload = { "cid": case_id, "name": str(directory_name) }
-            response = requests.post(url="https://{0}/case/notes/directories/add".format(self.cms),
+            response = self.http.post(url="{0}/case/notes/directories/add".format(self.cms),
                                      headers=self.cms_headers,
                                      data=json.dumps(payload),
                                      verify=False)
@@ -108,101 +275,385 @@ class IrisMethods():
                         "note_title": str(note_title),
                         "note_content": str(note),
                         "directory_id": dir_id }
-            response = requests.post(url="https://{0}/case/notes/add".format(self.cms),
+            response = self.http.post(url="{0}/case/notes/add".format(self.cms),
                                      headers=self.cms_headers,
                                      data=json.dumps(payload),
                                      verify=False)
             if response.status_code == 200:
+                note_id = (response.json().get('data') or {}).get('note_id')
+                if note_id is not None:
+                    self.note_cache.pop(note_id)
+                    self.note_ids.set((str(case_id), dir_id, str(note_title)), note_id)
                 return True
             else:
                 return False
         except Exception as e:
             return False
 
-    def get_case_notes(self, case_id) -> None:
-        """ Retrieve notes from a DFIR IRIS case """
+    def update_case_note(self, case_id, note_id, note_title, note) -> int:
+        """ Replace the title and content of an existing DFIR IRIS note, returning the HTTP status or None on error """
         try:
-            response = requests.get(url="https://{0}/case/notes/directories/filter?cid={1}".format(self.cms,case_id),
-                                    headers=self.cms_headers,
-                                    verify=False)
-            notes = response.json()['data']
-            return notes
+            payload = { "note_title": str(note_title),
+                        "note_content": str(note) }
+            response = self.http.post(url="{0}/case/notes/{1}/update?cid={2}".format(self.cms,note_id,case_id),
+                                     headers=self.cms_headers,
+                                     data=json.dumps(payload),
+                                     verify=False)
+            self.note_cache.pop(note_id)
+            return response.status_code
         except Exception as e:
-            logging.exception("Error retrieving notes: {0}".format(e))
             return None
 
+    def ensure_notes_directory(self, case_id, directory_name) -> str:
+        """ Look up or create a note directory, caching the case-to-directory mapping """
+        key = (str(case_id), str(directory_name))
+        dir_id = self.directory_ids.get(key)
+        if dir_id is not None:
+            return dir_id
+        try:
+            for directory in self.get_note_directories(case_id):
+                if directory.get('name') == directory_name:
+                    dir_id = directory['id']
+                    for note in directory.get('notes', []):
+                        self.note_ids.set((key[0], dir_id, note.get('title', '')), note['id'])
+                    break
+        except Exception as e:
+            # Without a successful listing we cannot tell whether the directory exists; creating one could duplicate it
+            logging.exception("Error listing note directories: {0}".format(e))
+            return None
+        if dir_id is None:
+            dir_id = self.create_notes_directory(case_id, directory_name)
+        if dir_id is not None:
+            self.directory_ids.set(key, dir_id)
+        return dir_id
+
+    def upsert_case_note(self, case_id, dir_id, note_title, note) -> bool:
+        """ Update the note with this title in the directory, adding it if there is none """
+        key = (str(case_id), dir_id, str(note_title))
+        note_id = self.note_ids.get(key)
+        if note_id is not None:
+            status = self.update_case_note(case_id, note_id, note_title, note)
+            if status == 200:
+                return True
+            if status != 404:
+                # Throttling, outages and timeouts leave the note in place; adding another would duplicate it
+                return False
+            # The note was removed in IRIS; forget it and add a fresh one
+            self.note_ids.pop(key)
+        return self.add_case_note(case_id, dir_id, note_title, note)
+
+    def write_commentary(self, case_id, commentary) -> bool:
+        """ Store GPT commentary on a case, once per case unless update_existing is off """
+        if not self.update_existing:
+            directory_id = self.create_notes_directory(case_id, "Analyst Commentary")
+            return self.add_case_note(case_id, directory_id, "Analyst Commentary", commentary)
+        directory_id = self.ensure_notes_directory(case_id, "Analyst Commentary")
+        if directory_id is None:
+            return False
+        return self.upsert_case_note(case_id, directory_id, "Analyst Commentary", commentary)
+
+    def iter_case_evidence(self, case_id):
+        """ Yield the description of each evidence item on a case as it is parsed, or None if IRIS did not answer """
+        response = self.http.get(url="{0}/case/evidences/list?cid={1}".format(self.cms,case_id),
+                                headers=self.cms_headers,
+                                stream=True,
+                                verify=False)
+        if response.status_code != 200:
+            response.close()
+            return None
+        return (item['file_description'] for item in jsonstream.iter_response(response, ['data', 'evidences']))
+
     def get_case_evidence(self, case_id) -> None:
         """ Retrieve evidence from a DFIR IRIS case """
         try:
-            evidence_str = ''
-            response = requests.get(url="https://{0}/case/evidences/list?cid={1}".format(self.cms,case_id),
-                                    headers=self.cms_headers,
-                                    verify=False)
-            if response.status_code == 200:
-                evidence = response.json()['data']['evidences']
-                if evidence:
-                    for item in evidence:
-                        evidence_str += item['file_description'] + '\n'
+            descriptions = self.iter_case_evidence(case_id)
+            if descriptions is not None:
+                evidence_str = ''.join(description + '\n' for description in descriptions)
+                if evidence_str:
                     return evidence_str
         except Exception as e:
             return None
         
-    def annotate_case(self,case_id) -> bool:
-        """ Annotate a DFIR IRIS case with GPT commentary """
+    def case_severity(self, case_id):
+        """ Severity rank of an indexed case, used to route its annotation """
+        case = self.index.get(int(case_id)) or {}
+        return case.get('severity_rank')
+
+    def annotate_case(self,case_id,on_delta=None) -> bool:
+        """ Annotate a DFIR IRIS case with GPT commentary, optionally streaming it to on_delta """
         try:
-            note_directory_id = self.create_notes_directory(case_id,"Analyst Commentary")
             evidence = self.get_case_evidence(case_id)
-            commentary = self.g.create_completion(evidence)
-            self.add_case_note(case_id,note_directory_id,"Analyst Commentary",commentary)
-            return True
+            if not evidence:
+                logging.info("No evidence found for case {0}".format(case_id))
+                return False
+            return self.annotate_evidence(case_id, evidence, on_delta)
         except Exception as e:
             logging.exception("Error annotating case: {0}".format(e))
             return False
+
+    def annotate_evidence(self, case_id, evidence, on_delta=None) -> bool:
+        """ Annotate a case from evidence already fetched """
+        commentary = self.g.summarize_evidence(evidence, on_delta, self.case_severity(case_id))
+        if not commentary:
+            return False
+        return self.write_commentary(case_id, commentary)
+
+    def has_commentary(self, case_id) -> bool:
+        """ Whether a case already carries an Analyst Commentary note """
+        for directory in self.get_note_directories(case_id):
+            if directory.get('name') == "Analyst Commentary" and directory.get('notes'):
+                return True
+        return False
         
-    def annotate_all_cases(self) -> bool:
-        """ Annotate all DFIR IRIS cases with GPT commentary """
+    def annotate_all_cases(self, progress=None, cancelled=None) -> dict:
+        """ Annotate all open DFIR IRIS cases concurrently, returning a result per case """
+        results = {}
         self.get_open_cases()
-        try:
-            for case in self.cases:
-                self.annotate_case(case['case_id'])
-            return True
-        except Exception as e:
-            return False
+        case_ids = [case['case_id'] for case in self.cases]
+        if not case_ids:
+            return results
+        if self.cluster_duplicates:
+            return self.annotate_clusters(case_ids, progress, cancelled)
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            futures = {pool.submit(self.annotate_case, case_id): case_id for case_id in case_ids}
+            for future in as_completed(futures):
+                case_id = futures[future]
+                try:
+                    results[case_id] = bool(future.result())
+                except Exception as e:
+                    logging.exception("Error annotating case {0}: {1}".format(case_id, e))
+                    results[case_id] = False
+                if progress:
+                    progress(len(results), len(case_ids))
+                if cancelled and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        return results
         
-    def get_case_notes(self, case_id) -> None:
-        """ Retrieve notes from a DFIR IRIS case """
+    def cluster_cases(self, case_ids, evidence) -> list:
+        """ Group cases with near-duplicate evidence and IOCs; the first member of each cluster is its representative """
+        stale = self.ioc_index.stale(case_ids, self.ioc_ttl)
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            list(pool.map(self.get_case_iocs, stale))
+        signatures = {case_id: self.minhasher.signature(similarity.features(evidence[case_id],
+                                                                             self.ioc_index.values_for(case_id)))
+                      for case_id in case_ids}
+        return similarity.cluster(signatures, self.lsh_bands, self.similarity_threshold)
+
+    def collect_results(self, futures, results, total, progress=None, cancelled=None) -> bool:
+        """ Record each future's outcome under its case ID; returns False if the job was cancelled """
+        for future in as_completed(futures):
+            case_id = futures[future]
+            try:
+                results[case_id] = bool(future.result())
+            except Exception as e:
+                logging.exception("Error annotating case {0}: {1}".format(case_id, e))
+                results[case_id] = False
+            if progress:
+                progress(len(results), total)
+            if cancelled and cancelled():
+                for pending in futures:
+                    pending.cancel()
+                return False
+        return True
+
+    def annotate_clusters(self, case_ids, progress=None, cancelled=None) -> dict:
+        """ Annotate one representative per near-duplicate cluster and reuse its commentary for the rest """
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            evidence = dict(zip(case_ids, pool.map(self.get_case_evidence, case_ids)))
+        for case_id in case_ids:
+            if not evidence[case_id]:
+                logging.info("No evidence found for case {0}".format(case_id))
+                results[case_id] = False
+        clusters = self.cluster_cases([case_id for case_id in case_ids if case_id not in results], evidence)
+        logging.info("Annotating {0} cases as {1} clusters".format(len(case_ids) - len(results), len(clusters)))
+        commentary = {}
+
+        def annotate(members):
+            representative = members[0]
+            severity = max([self.case_severity(case_id) or 0 for case_id in members]) or None
+            commentary[representative] = self.g.summarize_evidence(evidence[representative], severity=severity)
+            if not commentary[representative]:
+                return False
+            return self.write_commentary(representative, commentary[representative])
+
+        def reuse(case_id, representative):
+            note = "{0}\n\n---\nCommentary reused from near-duplicate case {1}: {2}/case?cid={1}".format(
+                commentary[representative], representative, self.cms)
+            return self.write_commentary(case_id, note)
+
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            futures = {pool.submit(annotate, members): members[0] for members in clusters}
+            if not self.collect_results(futures, results, len(case_ids), progress, cancelled):
+                return results
+            futures = {}
+            for members in clusters:
+                for case_id in members[1:]:
+                    if commentary.get(members[0]):
+                        futures[pool.submit(reuse, case_id, members[0])] = case_id
+                    else:
+                        results[case_id] = False
+            self.collect_results(futures, results, len(case_ids), progress, cancelled)
+        return results
+
+    def annotate_all_cases_batch(self, progress=None, cancelled=None) -> dict:
+        """ Annotate all open DFIR IRIS cases through the OpenAI Batch API """
+        results = {}
+        self.get_open_cases()
+        case_ids = [case['case_id'] for case in self.cases]
+        if not case_ids:
+            return results
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            evidence = dict(zip(case_ids, pool.map(self.get_case_evidence, case_ids)))
+        prompts = {}
+        for case_id in case_ids:
+            if not evidence[case_id]:
+                results[case_id] = False
+            elif estimate_tokens(evidence[case_id]) <= self.g.context_budget:
+                prompts[case_id] = evidence[case_id]
+        completions = self.g.run_batch(prompts, cancelled,
+                                       {case_id: self.case_severity(case_id) for case_id in prompts})
+
+        def write_note(case_id):
+            if case_id in prompts:
+                commentary = completions.get(str(case_id))
+            else:
+                # Oversized evidence still goes through the interactive map-reduce path
+                commentary = self.g.summarize_evidence(evidence[case_id], severity=self.case_severity(case_id))
+            if not commentary:
+                return False
+            return self.write_commentary(case_id, commentary)
+
+        remaining = [case_id for case_id in case_ids if case_id not in results]
+        with ThreadPoolExecutor(max_workers=max(1, int(self.workers))) as pool:
+            futures = {pool.submit(write_note, case_id): case_id for case_id in remaining}
+            for future in as_completed(futures):
+                case_id = futures[future]
+                try:
+                    results[case_id] = bool(future.result())
+                except Exception as e:
+                    logging.exception("Error annotating case {0}: {1}".format(case_id, e))
+                    results[case_id] = False
+                if progress:
+                    progress(len(results), len(case_ids))
+        return results
+
+    def note_record(self, note, directory='') -> dict:
+        """ Project an IRIS note onto the fields the bot uses """
+        return {
+            'note_id': note.get('note_id', note.get('id')),
+            'directory': directory,
+            'title': note.get('note_title', note.get('title', '')),
+            'content': note.get('note_content', ''),
+            'created': note.get('note_creationdate', ''),
+            'modified': note.get('note_lastupdate', ''),
+        }
+
+    def get_note_directories(self, case_id) -> list:
+        """ List a case's note directories and the notes they contain """
+        response = self.http.get(url="{0}/case/notes/directories/filter?cid={1}".format(self.cms,case_id),
+                                 headers=self.cms_headers,
+                                 verify=False)
+        response.raise_for_status()
+        return response.json()['data']
+
+    def get_note(self, case_id, note_id, directory='') -> dict:
+        """ Retrieve a single note, served from the note cache when possible """
+        note = self.note_cache.get(note_id)
+        if note is not None:
+            return note
+        response = self.http.get(url="{0}/case/notes/{1}?cid={2}".format(self.cms,note_id,case_id),
+                                 headers=self.cms_headers,
+                                 verify=False)
+        if response.status_code != 200:
+            return None
+        note = self.note_record(response.json()['data'], directory)
+        note['note_id'] = note_id
+        self.note_cache.set(note_id, note)
+        return note
+
+    def get_case_notes(self, case_id) -> list:
+        """ Retrieve every note of a DFIR IRIS case, fetching uncached notes concurrently """
         try:
-            response = requests.get(url="https://{0}/case/notes/directories/filter?cid={1}".format(self.cms,case_id),
-                                    headers=self.cms_headers,
-                                    verify=False)
-            directories = response.json()['data']
-            for directory in directories:
-                for note in directory['notes']:
-                    try:
-                        response = requests.get(url="https://{0}/case/notes/{1}?cid={2}".format(self.cms,note['id'],case_id),
-                                                headers=self.cms_headers,
-                                                verify=False)
-                        if response.status_code == 200:
-                            data = response.json()['data']['note_content']
-                            return data
-                        else:
-                            return "No commentary found"
-                    except Exception as e:
-                        pass
+            listed = []
+            for directory in self.get_note_directories(case_id):
+                for note in directory.get('notes', []):
+                    listed.append((note['id'], directory.get('name', '')))
+            if not listed:
+                return []
+            with ThreadPoolExecutor(max_workers=max(1, min(int(self.workers), len(listed)))) as pool:
+                notes = pool.map(lambda item: self.get_note(case_id, item[0], item[1]), listed)
+                return [note for note in notes if note is not None]
         except Exception as e:
+            logging.exception("Error retrieving notes: {0}".format(e))
             return None
+
+    def get_case_commentary(self, case_id) -> str:
+        """ Format all notes of a case for chat """
+        notes = self.get_case_notes(case_id)
+        if notes is None:
+            return None
+        if not notes:
+            return "No commentary found"
+        sections = []
+        for note in notes:
+            heading = "#### {0} / {1}".format(note['directory'], note['title'])
+            if note['modified']:
+                heading += " ({0})".format(note['modified'])
+            sections.append("{0}\n{1}".format(heading, note['content']))
+        return '\n\n'.join(sections)
         
+    def fetch_case_iocs(self, case_id):
+        """ Yield the raw IOC values recorded on a case as they are parsed, or None if IRIS did not answer """
+        response = self.http.get(url="{0}/case/ioc/list?cid={1}".format(self.cms,case_id),
+                                headers=self.cms_headers,
+                                stream=True,
+                                verify=False)
+        if response.status_code != 200:
+            response.close()
+            return None
+        return (ioc['ioc_value'] for ioc in jsonstream.iter_response(response, ['data', 'ioc']))
+
     def get_case_iocs(self, case_id) -> str:
         try:
-            response = requests.get(url="https://{0}/case/ioc/list?cid={1}".format(self.cms,case_id),
-                                    headers=self.cms_headers,
-                                    verify=False)
-            iocs = response.json()['data']
-            values = []
-            for ioc in iocs['ioc']:
-                values.append(ioc['ioc_value'])
+            values = self.fetch_case_iocs(case_id)
+            if values is not None:
+                values = list(values)
+                self.ioc_index.put(int(case_id), values)
             return values
         except Exception as e:
             return None
 
+    def index_iocs(self) -> int:
+        """ Index IOCs of new or stale open cases and drop closed cases, returning the number fetched """
+        with self.ioc_lock:
+            open_ids = {int(case['case_id']) for case in self.index.query(state='Open')}
+            for case_id in self.ioc_index.case_ids() - open_ids:
+                self.ioc_index.remove(case_id)
+            stale = self.ioc_index.stale(sorted(open_ids), self.ioc_ttl)
+            if not stale or not self.http.transport.available('iris'):
+                return 0
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # get_case_iocs parses and indexes on the worker, so responses are consumed as they arrive
+                list(pool.map(self.get_case_iocs, stale))
+            logging.info("Indexed IOCs for {0} cases".format(len(stale)))
+            return len(stale)
+
+    def lookup_ioc(self, value) -> dict:
+        """ Open cases carrying an IOC, by exact value, 'prefix*' or CIDR range """
+        self.get_open_cases()
+        self.index_iocs()
+        return self.ioc_index.lookup(value)
+
+    def related_cases(self, case_id) -> dict:
+        """ Open cases sharing at least one IOC with case_id, with the shared values """
+        case_id = int(case_id)
+        self.get_open_cases()
+        self.index_iocs()
+        if case_id not in self.ioc_index:
+            self.get_case_iocs(case_id)
+        return self.ioc_index.related(case_id)
+
 
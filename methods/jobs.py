@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from datetime import datetime
+import itertools
+import threading
+import logging
+import queue
+import time
+
+class Job():
+    """ A queued bot command with an ID, status and cancellation flag """
+
+    def __init__(self, job_id, description, func):
+        self.id = job_id
+        self.description = description
+        self.func = func
+        self.status = 'queued'
+        self.created = datetime.now()
+        self.started = None
+        self.finished = None
+        self.done = 0
+        self.total = 0
+        self.cancel_event = threading.Event()
+        self.notify = None
+        self.progress_interval = 0
+        self.last_progress = 0
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def progress(self, done, total) -> None:
+        """ Record progress and post it at most once per progress interval """
+        self.done = done
+        self.total = total
+        now = time.monotonic()
+        if self.notify and done < total and now - self.last_progress >= self.progress_interval:
+            self.last_progress = now
+            self.notify("Job {0} progress: {1}/{2}".format(self.id, done, total))
+
+    def describe(self) -> str:
+        line = "Job {0} [{1}] {2}".format(self.id, self.status, self.description)
+        if self.total:
+            line += " ({0}/{1})".format(self.done, self.total)
+        return line
+
+class JobQueue():
+    """ Runs bot commands on background worker threads """
+
+    def __init__(self, workers=2, notify=None, progress_interval=30, history=50):
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.notify = notify
+        self.progress_interval = progress_interval
+        self.history = history
+        self.threads = []
+        for i in range(max(1, int(workers))):
+            thread = threading.Thread(target=self.worker, name="job-worker-{0}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, description, func) -> Job:
+        """ Queue func(job) for execution and return the job """
+        with self.lock:
+            job = Job(next(self.ids), description, func)
+            job.notify = self.notify
+            job.progress_interval = self.progress_interval
+            self.jobs[job.id] = job
+            self.prune()
+        self.queue.put(job)
+        return job
+
+    def prune(self) -> None:
+        """ Drop the oldest finished jobs beyond the history limit """
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def list_jobs(self) -> list:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id) -> bool:
+        """ Request cancellation of a queued or running job """
+        with self.lock:
+            job = self.jobs.get(int(job_id))
+        if job is None or job.finished:
+            return False
+        job.cancel()
+        return True
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def post(self, message) -> None:
+        if self.notify:
+            self.notify(message)
+
+    def worker(self) -> None:
+        while True:
+            job = self.queue.get()
+            try:
+                self.run(job)
+            finally:
+                self.queue.task_done()
+
+    def run(self, job) -> None:
+        if job.cancelled():
+            job.status = 'cancelled'
+            job.finished = datetime.now()
+            return
+        job.status = 'running'
+        job.started = datetime.now()
+        try:
+            job.func(job)
+            job.status = 'cancelled' if job.cancelled() else 'finished'
+        except Exception as e:
+            logging.exception("Job {0} failed: {1}".format(job.id, e))
+            job.status = 'failed'
+        job.finished = datetime.now()
+        elapsed = (job.finished - job.started).total_seconds()
+        self.post("Job {0} {1} after {2:.1f}s: {3}".format(job.id, job.status, elapsed, job.description))
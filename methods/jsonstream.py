@@ -0,0 +1,110 @@
+import codecs
+import json
+
+DECODER = json.JSONDecoder()
+WHITESPACE = ' \t\n\r'
+# Characters that may follow a complete value; anything else means a scalar was cut at a chunk boundary
+DELIMITERS = WHITESPACE + ',]}:'
+
+class Reader():
+    """ Incremental JSON reader over an iterable of byte chunks, holding at most one value beyond the current chunk """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> None:
+        if self.eof:
+            raise ValueError("Unexpected end of JSON stream")
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        try:
+            self.buffer += self.decoder.decode(next(self.chunks))
+        except StopIteration:
+            self.buffer += self.decoder.decode(b'', final=True)
+            self.eof = True
+
+    def peek(self) -> str:
+        """ Skip whitespace and return the next character, or '' at the end of the stream """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self.fill()
+
+    def expect(self, char) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected {0!r} in JSON stream, found {1!r}".format(char, found))
+        self.pos += 1
+
+    def value(self):
+        """ Decode the next complete JSON value, reading more chunks until it is whole """
+        while True:
+            self.peek()
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+                # '1.' + '5' decodes as 1 and '1.5e' + '3' as 1.5, so only trust a value followed by a delimiter
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def members(self, meta=None, stop=None):
+        """ Walk the members of the current object, recording them in meta, until the key stop is reached """
+        while True:
+            char = self.peek()
+            if char == ',':
+                self.pos += 1
+                continue
+            if char in ('}', ''):
+                self.pos += 1
+                return False
+            name = self.value()
+            self.expect(':')
+            if name == stop:
+                return True
+            value = self.value()
+            if meta is not None:
+                meta[name] = value
+
+def iter_array(chunks, path, meta=None):
+    """ Yield the items of the array at path (a list of object keys) one at a time.
+
+        Members met on the way, before and after the array, are stored in meta so
+        callers can still read small fields such as pagination. """
+    reader = Reader(chunks)
+    for key in path:
+        reader.expect('{')
+        if not reader.members(meta, stop=key):
+            raise KeyError(key)
+    reader.expect('[')
+    while True:
+        char = reader.peek()
+        if char == ',':
+            reader.pos += 1
+            continue
+        if char == ']':
+            reader.pos += 1
+            break
+        if char == '':
+            raise ValueError("Unexpected end of JSON stream")
+        yield reader.value()
+    for key in path:
+        reader.members(meta)
+
+def iter_response(response, path, meta=None, chunk_size=65536):
+    """ Stream the array at path out of a requests response, closing it when done """
+    try:
+        yield from iter_array(response.iter_content(chunk_size), path, meta)
+    finally:
+        response.close()
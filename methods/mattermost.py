@@ -1,38 +1,126 @@
 from datetime import datetime, timedelta
 from methods.vault import VaultMethods
 from methods.iris import IrisMethods
-import requests
+from methods.events import MattermostEvents
+from methods.jobs import JobQueue
+from methods.cache import LRUCache
+from methods import metrics
+from methods import output
+from methods import transport
+import threading
 import logging
+import queue
 import time
 import json
 import yaml
 import sys
 import os
 
+BACKEND_NAMES = {'mattermost': 'Mattermost', 'iris': 'IRIS', 'gpt': 'OpenAI', 'vault': 'Vault'}
+
 class MattermostMethods():
 
-    def __init__(self):
-        self.v = VaultMethods()
-        self.iris = IrisMethods()
+    def __init__(self, vault=None, iris_factory=None):
+        self.http = transport.client('mattermost')
+        self.v = vault or VaultMethods()
+        self.iris_instance = None
+        self.iris_factory = iris_factory or (lambda: IrisMethods(vault=self.v))
+        self.iris_lock = threading.Lock()
         self.polling_interval = 0
         self.mattermost = ''
         self.mentions = []
         self.commands = []
         self.username = ''
         self.bot_id = ''
+        self.job_workers = 2
+        self.job_progress_interval = 30
+        self.inline_commands = ['jobs', 'howto', 'health', 'shutdown']
+        self.mode = 'polling'
+        self.websocket_url = ''
+        self.events = None
+        self.dedupe_size = 1000
+        self.dedupe_ttl = 3600
+        self.max_message_length = 16383
+        self.attach_threshold = 500
+        self.stream = True
+        self.stream_edit_interval = 1.0
         self.token = self.v.retrieve_mattermost_secrets()
         self.load_config()
-        self.processed_mentions = {}
+        self.processed_mentions = LRUCache(maxsize=self.dedupe_size, ttl=self.dedupe_ttl)
+        self.started_at = int((datetime.now() - timedelta(minutes=self.polling_interval)).timestamp() * 1000)
+        self.last_create_at = self.started_at
+        self.last_post_id = ''
+        self.jobs = JobQueue(workers=self.job_workers,
+                             notify=self.post_message,
+                             progress_interval=self.job_progress_interval)
+        metrics.queue_depth.set_function(self.jobs.depth)
         self.mm_headers = {
             'Content-Type':'application/json',
             'Authorization':'Bearer {0}'.format(self.token)
         }
+        self.v.watch('mattermost', self.v.mattermost_token_path, 'key', self.set_token)
         self.command_options = {
-            'cases': ['list', 'annotate', 'iocs', 'commentary', 'close'],
+            'cases': ['list', 'annotate', 'iocs', 'related', 'commentary', 'close'],
+            'iocs': ['lookup'],
+            'gpt': ['stats'],
+            'health': ['status'],
             'auth': ['status','renew'],
             'howto': ['commands'],
+            'jobs': ['list', 'cancel'],
             'shutdown': ['now']  
         }
+        self.command_backends = {
+            'annotate': ('iris', 'gpt'),
+            'commentary': ('iris',),
+            'close': ('iris',),
+        }
+        if self.mode == 'websocket':
+            self.start_events()
+
+    @property
+    def iris(self):
+        """ IRIS client, created on the first command that needs it """
+        with self.iris_lock:
+            if self.iris_instance is None:
+                self.iris_instance = self.iris_factory()
+            return self.iris_instance
+
+    def degraded(self, backend) -> str:
+        """ Note appended to replies served from cached data while a backend is down """
+        if self.http.transport.available(backend):
+            return ''
+        return " ({0} unavailable, showing cached data)".format(BACKEND_NAMES[backend])
+
+    def require(self, backend) -> bool:
+        """ Refuse a command that needs a backend whose circuit is open, saying when it will be retried """
+        if self.http.transport.available(backend):
+            return True
+        state = self.http.transport.breaker_for(backend).describe()
+        self.post_message("{0} is unavailable, retrying in {1}s: {2}".format(BACKEND_NAMES[backend], state['retry_in'], state['last_error']))
+        return False
+
+    def post_health(self):
+        """ Post backend circuit states and the age of the cached data used in degraded mode """
+        rows = []
+        for backend in BACKEND_NAMES:
+            state = self.http.transport.breaker_for(backend).describe()
+            rows.append((BACKEND_NAMES[backend], state['state'], state['failures'],
+                         "{0}s".format(state['retry_in']) if state['retry_in'] else '', state['last_error'][:120]))
+        self.post_table("Backend health", ["Backend", "Circuit", "Failures", "Retry in", "Last error"], rows)
+        if self.iris_instance is not None:
+            synced = self.iris.index.synced_at
+            self.post_message("Case index: {0} cases, synced {1}; IOC index: {2} values".format(
+                len(self.iris.index),
+                "{0}s ago".format(int(time.time() - synced)) if synced else 'never',
+                len(self.iris.ioc_index)))
+
+    def set_token(self, token) -> dict:
+        """ Swap in a rotated bot token; the WebSocket picks it up on its next reconnect """
+        self.token = token
+        self.mm_headers['Authorization'] = 'Bearer {0}'.format(token)
+        if self.events is not None:
+            self.events.token = token
+        return {'Authorization': self.mm_headers['Authorization']}
 
     def load_config(self):
         try:
@@ -41,20 +129,30 @@ class MattermostMethods():
                 with open('configuration/mattermost.yaml', 'r') as f:
                     config = yaml.safe_load(f)
                     config = config['mattermost']
-                    self.mattermost = config['fqdn']
+                    self.mattermost = transport.base_url(config['fqdn'])
                     self.channel = config['channel']
                     self.bot_id = config['user_id']
                     self.team_id = config['team_id']
                     self.username = config['username']
                     self.channel_id = config['channel_id']
                     self.polling_interval = config['polling_interval']
+                    self.job_workers = config.get('job_workers', self.job_workers)
+                    self.mode = config.get('mode', self.mode)
+                    self.dedupe_size = config.get('dedupe_size', self.dedupe_size)
+                    self.dedupe_ttl = config.get('dedupe_ttl', self.dedupe_ttl)
+                    self.max_message_length = config.get('max_message_length', self.max_message_length)
+                    self.attach_threshold = config.get('attach_threshold', self.attach_threshold)
+                    self.stream = config.get('stream', self.stream)
+                    self.stream_edit_interval = config.get('stream_edit_interval', self.stream_edit_interval)
+                    self.websocket_url = config.get('websocket_url', self.websocket_url)
+                    self.job_progress_interval = config.get('job_progress_interval', self.job_progress_interval)
         except Exception as e:
             logging.exception("Failed to load Mattermost configuration")
             sys.exit(1)
 
     def get_users(self):
         try:
-            response = requests.get(url="https://{0}/api/v4/users".format(self.mattermost),
+            response = self.http.get(url="{0}/api/v4/users".format(self.mattermost),
                                     headers=self.mm_headers,
                                     verify=False)
             users = response.json()
@@ -67,13 +165,12 @@ class MattermostMethods():
         
     def get_teams(self):
         try:
-            response = requests.get(url="https://{0}/api/v4/teams".format(self.mattermost),
+            response = self.http.get(url="{0}/api/v4/teams".format(self.mattermost),
                                     headers=self.mm_headers,
                                     verify=False)
             teams = response.json()
             for team in teams:
                 logging.info("Team: {0}".format(team))
-                print()
             return teams
         except Exception as e:
             logging.exception("Error retrieving teams: {0}".format(e))
@@ -81,7 +178,7 @@ class MattermostMethods():
         
     def get_channels(self):
         try:
-            response = requests.get(url="https://{0}/api/v4/channels".format(self.mattermost),
+            response = self.http.get(url="{0}/api/v4/channels".format(self.mattermost),
                                     headers=self.mm_headers,
                                     verify=False)
             channels = response.json()
@@ -92,113 +189,317 @@ class MattermostMethods():
             logging.exception("Error retrieving channels: {0}".format(e))
             return None
 
-    def post_message(self, message):
+    def post_message(self, message, file_ids=None):
         try:
             payload = {
                 "channel_id": self.channel_id,
                 "message": message
             }
-            response = requests.post(url="https://{0}/api/v4/posts".format(self.mattermost),
+            if file_ids:
+                payload['file_ids'] = file_ids
+            response = self.http.post(url="{0}/api/v4/posts".format(self.mattermost),
                                      headers=self.mm_headers,
                                      data=json.dumps(payload),
                                      verify=False)
             if response.status_code == 201:
                 logging.info("Message posted")
+                return response.json().get('id')
             else:
                 logging.error("Failed to post message: {0}".format(response.text))
         except Exception as e:
             logging.exception("Error posting message: {0}".format(e))
 
+    def update_message(self, post_id, message):
+        """ Replace the text of an existing post """
+        try:
+            response = self.http.put(url="{0}/api/v4/posts/{1}/patch".format(self.mattermost, post_id),
+                                     headers=self.mm_headers,
+                                     data=json.dumps({"message": message}),
+                                     verify=False)
+            if response.status_code != 200:
+                logging.error("Failed to update message: {0}".format(response.text))
+        except Exception as e:
+            logging.exception("Error updating message: {0}".format(e))
+
+    def stream_relay(self, header):
+        """ Return a relay that streams text into a single post """
+        return output.StreamRelay(self.post_message,
+                                  self.update_message,
+                                  header=header,
+                                  interval=self.stream_edit_interval,
+                                  limit=self.max_message_length)
+
+    def post_long_message(self, message):
+        """ Post text that may exceed the server's message size limit """
+        for chunk in output.chunk_text(message, self.max_message_length):
+            self.post_message(chunk)
+
+    def upload_file(self, filename, content):
+        """ Upload a file to the channel and return its file ID """
+        try:
+            response = self.http.post(url="{0}/api/v4/files".format(self.mattermost),
+                                     headers={'Authorization': self.mm_headers['Authorization']},
+                                     data={'channel_id': self.channel_id},
+                                     files={'files': (filename, content)},
+                                     verify=False)
+            if response.status_code == 201:
+                return response.json()['file_infos'][0]['id']
+            logging.error("Failed to upload file: {0}".format(response.text))
+            return None
+        except Exception as e:
+            logging.exception("Error uploading file: {0}".format(e))
+            return None
+
+    def post_table(self, title, headers, rows):
+        """ Post rows as Markdown tables in as few messages as possible, attaching
+            large result sets as a file instead """
+        rows = list(rows)
+        if not rows:
+            self.post_message("{0}: no results".format(title))
+            return
+        if self.attach_threshold and len(rows) > self.attach_threshold:
+            content = '\n'.join(output.markdown_table(headers, rows))
+            filename = "{0}.md".format(title.lower().replace(' ', '_'))
+            file_id = self.upload_file(filename, content.encode('utf-8'))
+            if file_id:
+                self.post_message("{0}: {1} rows attached".format(title, len(rows)), file_ids=[file_id])
+                return
+        for message in output.chunk_table(title, headers, rows, self.max_message_length):
+            self.post_message(message)
+
     def get_mentions(self):
+        """ Fetch posts created since the last cursor position """
+        if not self.http.transport.available('mattermost'):
+            return None
         try:
-            url = "https://{0}/api/v4/channels/{1}/posts".format(self.mattermost, self.channel_id)
-            response = requests.get(url=url,
+            url = "{0}/api/v4/channels/{1}/posts".format(self.mattermost, self.channel_id)
+            response = self.http.get(url=url,
                                     headers=self.mm_headers,
+                                    params={'since': self.last_create_at},
                                     verify=False)
             if response.status_code == 200:
-                posts = response.json().get('posts', {})
-                now = datetime.now()
-                interval = now - timedelta(minutes=self.polling_interval)
-                mentions = []
-                for post in posts.values():
-                    post_time = datetime.fromtimestamp(post['create_at'] / 1000)
-                    if f"@{self.username}" in post.get('message', '') and post_time > interval:
-                        mentions.append(post['message'])
-                for mention in mentions:
-                    command_with_args = ' '.join(mention.split(' ')[1:])
-                    self.mentions.append(command_with_args)
+                posts = response.json().get('posts') or {}
+                for post in sorted(posts.values(), key=lambda post: post.get('create_at', 0)):
+                    self.ingest_post(post)
             else:
                 logging.error("Failed to retrieve posts: {0} - {1}".format(response.status_code, response.text))
-                self.mentions = []
         except Exception as e:
             logging.exception("Error retrieving mentions: {0}".format(e))
             return None
+
+    def ingest_post(self, post):
+        """ Advance the cursor and queue the post's command if it is a new mention """
+        create_at = post.get('create_at', 0)
+        if create_at > self.last_create_at:
+            self.last_create_at = create_at
+            self.last_post_id = post.get('id', self.last_post_id)
+        if post.get('delete_at') or create_at < self.started_at:
+            return
+        mention = self.mention_command(post)
+        if mention is None or post.get('id') in self.processed_mentions:
+            return
+        self.processed_mentions.set(post.get('id'), create_at)
+        self.mentions.append((mention, create_at))
     
+    def mention_command(self, post):
+        """ Return the command text of a post that mentions the bot """
+        message = post.get('message', '')
+        if f"@{self.username}" not in message:
+            return None
+        return ' '.join(message.split(' ')[1:])
+
     def process_mentions(self):
         try:
             self.get_mentions()
-            if self.mentions:
-                now = datetime.now()
-                for mention in self.mentions:
-                    last_processed_time = self.processed_mentions.get(mention)
-                    if not last_processed_time or (now - last_processed_time).total_seconds() > self.polling_interval * 60:
-                        self.processed_mentions[mention] = now
-                        command, *args = mention.split(' ')
-                        if command.startswith('/'):
-                            self.handle_command(command[1:], args)
-                self.mentions.clear()
+            self.run_mentions()
         except Exception as e:
             logging.exception("Error processing mentions")
-            self.post_message({"channel_id": self.channel_id, "message": "Instruction processing failure"})
-        finally:
-            time.sleep(self.polling_interval)
+            self.post_message("Instruction processing failure")
 
-    def handle_command(self, command, args):
+    def process_events(self, timeout):
+        """ Handle mentions delivered over the WebSocket, waiting up to timeout seconds """
+        try:
+            if self.events.resync.is_set():
+                self.events.resync.clear()
+                self.get_mentions()
+            try:
+                post = self.events.posts.get(timeout=timeout)
+            except queue.Empty:
+                post = None
+            while post is not None:
+                self.ingest_post(post)
+                try:
+                    post = self.events.posts.get_nowait()
+                except queue.Empty:
+                    post = None
+            self.run_mentions()
+        except Exception as e:
+            logging.exception("Error processing events")
+            self.post_message("Instruction processing failure")
+
+    def run_mentions(self):
+        for mention, create_at in self.mentions:
+            command, *args = mention.split(' ')
+            if command.startswith('/'):
+                self.dispatch_command(command[1:], args)
+                metrics.mention_latency.observe(max(0.0, time.time() - create_at / 1000),
+                                                command=command[1:] if command[1:] in self.command_options else 'invalid')
+        self.mentions.clear()
+
+    def start_events(self) -> bool:
+        """ Switch to WebSocket event ingestion, keeping REST polling as the fallback """
+        url = self.websocket_url or "{0}/api/v4/websocket".format(self.mattermost.replace('http', 'ws', 1))
+        self.events = MattermostEvents(url, self.token, self.channel_id)
+        if not self.events.start():
+            self.events = None
+            return False
+        return True
+
+    def events_connected(self) -> bool:
+        return self.events is not None and self.events.connected.is_set()
+
+    def dispatch_command(self, command, args):
+        """ Run lightweight commands inline and queue everything else as a job """
+        if command in self.inline_commands or command not in self.command_options.keys():
+            self.handle_command(command, args)
+            return
+        description = ' '.join(['/' + command] + args)
+        job = self.jobs.submit(description, lambda job: self.handle_command(command, args, job))
+        self.post_message("Job {0} queued: {1}".format(job.id, description))
+
+    def bulk_close(self, args, progress=None, cancelled=None):
+        """ /cases close all|ids <a,b>|range <low-high>|older <days>|customer <id> [dry-run] """
+        dry_run = args[-1] == 'dry-run'
+        if dry_run:
+            args = args[:-1]
+        selector = args[0] if args else ''
+        value = args[1] if len(args) > 1 else ''
+        ids = [i.strip() for i in value.split(',') if i.strip().isdigit()]
+        if selector == 'ids' and ids:
+            case_ids = self.iris.select_cases(case_ids=ids)
+        elif selector == 'range' and value.replace('-', '', 1).isdigit() and '-' in value:
+            low, high = value.split('-', 1)
+            case_ids = self.iris.select_cases(id_range=(int(low), int(high)))
+        elif selector == 'older' and value.isdigit():
+            case_ids = self.iris.select_cases(older_than_days=int(value))
+        elif selector == 'customer' and value:
+            case_ids = self.iris.select_cases(customer=value)
+        elif selector == 'all':
+            case_ids = self.iris.select_cases()
+        else:
+            self.post_message("Invalid command option")
+            return
+        if dry_run:
+            self.post_message("Dry run: {0} cases would be closed".format(len(case_ids)))
+            if case_ids:
+                self.post_long_message(', '.join(str(case_id) for case_id in case_ids))
+            return
+        self.post_message("Closing {0} cases".format(len(case_ids)))
+        results = self.iris.close_cases(case_ids, progress=progress, cancelled=cancelled)
+        failed = [str(case_id) for case_id, ok in results.items() if not ok]
+        self.post_message("Closed {0} of {1} cases".format(len(results) - len(failed), len(case_ids)))
+        if failed:
+            self.post_message("Failed to close cases: {0}".format(', '.join(failed)))
+
+    def handle_command(self, command, args, job=None):
+        progress = job.progress if job else None
+        cancelled = job.cancelled if job else None
+        # Label only with known commands and options so chat typos cannot create new series
+        label = command if command in self.command_options else 'invalid'
+        option = ''
+        if args:
+            option = args[0] if label != 'invalid' and args[0] in self.command_options[command] else 'invalid'
+        metrics.commands.inc(command=label, option=option)
+        started = time.perf_counter()
         try:
             if command in self.command_options.keys():
                 if command == 'cases':
                     if args[0] in self.command_options[command]:
                         if args[0] == 'list':
                             self.iris.get_open_cases()
-                            for case in self.iris.cases:
-                                print(case,'\n')
-                                self.post_message("Case ID: {0}\nCase Title: {1}".format(case['case_id'], case['case_name']))
+                            self.post_table("Open cases" + self.degraded('iris'),
+                                            ["Case ID", "Case Title"],
+                                            [(case['case_id'], case['case_name']) for case in self.iris.cases])
+                        elif not all(self.require(backend) for backend in self.command_backends.get(args[0], ())):
+                            # Writes and live reads cannot be served from cache; require() explains why
+                            pass
                         elif args[0] == 'annotate' and args[1].isdigit():
-                            result = self.iris.annotate_case(args[1])
+                            relay = self.stream_relay("Case {0} commentary:\n".format(args[1])) if self.stream else None
+                            result = self.iris.annotate_case(args[1], on_delta=relay)
+                            if relay:
+                                relay.finish()
                             if result:
                                 self.post_message("Case {0} annotated".format(args[1]))
                             else:
                                 self.post_message("Failed to annotate case {0}".format(args[1]))
                         elif args[0] == 'annotate' and args[1] == 'all':
                             self.post_message("Adding commentary to all open cases")
-                            result = self.iris.annotate_all_cases()
-                            if result:
-                                self.post_message("All cases annotated")
-                            else:
-                                self.post_message("Failed to annotate all cases")
+                            results = self.iris.annotate_all_cases(progress=progress, cancelled=cancelled)
+                            failed = [str(case_id) for case_id, ok in results.items() if not ok]
+                            self.post_message("Annotated {0} of {1} cases".format(len(results) - len(failed), len(results)))
+                            if failed:
+                                self.post_message("Failed to annotate cases: {0}".format(', '.join(failed)))
+                        elif args[0] == 'annotate' and args[1] == 'batch':
+                            self.post_message("Submitting all open cases for batch annotation")
+                            results = self.iris.annotate_all_cases_batch(progress=progress, cancelled=cancelled)
+                            failed = [str(case_id) for case_id, ok in results.items() if not ok]
+                            self.post_message("Annotated {0} of {1} cases".format(len(results) - len(failed), len(results)))
+                            if failed:
+                                self.post_message("Failed to annotate cases: {0}".format(', '.join(failed)))
                         elif args[0] == 'commentary':
-                            notes = self.iris.get_case_notes(args[1])
-                            self.post_message("Case {0} \n Analyst commentary: {1}".format(args[1], notes))
+                            notes = self.iris.get_case_commentary(args[1])
+                            self.post_long_message("Case {0} \n Analyst commentary: {1}".format(args[1], notes))
                         elif args[0] == 'iocs':
                             iocs = self.iris.get_case_iocs(args[1])
-                            for ioc in iocs:
-                                try:
-                                    self.post_message("Case {0} \n IOC: {1}".format(args[1], ioc))
-                                except Exception as e:
-                                    self.post_message("Failed to post IOC: {0}".format(e))
-                                    pass
+                            if iocs is None and args[1].isdigit() and int(args[1]) in self.iris.ioc_index:
+                                self.post_table("Case {0} IOCs{1}".format(args[1], self.degraded('iris')),
+                                                ["IOC"], [(ioc,) for ioc in sorted(self.iris.ioc_index.values_for(int(args[1])))])
+                            elif iocs is None:
+                                self.post_message("Failed to retrieve IOCs for case {0}".format(args[1]))
+                            else:
+                                self.post_table("Case {0} IOCs".format(args[1]), ["IOC"], [(ioc,) for ioc in iocs])
+                        elif args[0] == 'related' and args[1].isdigit():
+                            related = self.iris.related_cases(args[1])
+                            note = self.degraded('iris')
+                            rows = []
+                            for case_id, values in sorted(related.items(), key=lambda item: (-len(item[1]), item[0])):
+                                case = self.iris.index.get(case_id) or {}
+                                rows.append((case_id, case.get('case_name', ''), len(values), ', '.join(sorted(values))))
+                            if rows:
+                                self.post_table("Cases sharing IOCs with case {0}{1}".format(args[1], note),
+                                                ["Case ID", "Case Title", "Shared", "IOCs"], rows)
+                            else:
+                                self.post_message("No open cases share IOCs with case {0}".format(args[1]))
                         elif args[0] == 'close' and args[1].isdigit():
                             result = self.iris.close_case(args[1])
                             if result:
                                 self.post_message("Case {0} successfully closed".format(args[1]))
                             else:
                                 self.post_message("Failed to close case {0}".format(args[1]))
-                        elif args[0] == 'close' and args[1] == 'all':
-                            result = self.iris.close_all_cases()
-                            if result:
-                                self.post_message("Successfully closed all cases")
+                        elif args[0] == 'close' and args[1] in ('all', 'ids', 'range', 'older', 'customer'):
+                            self.bulk_close(args[1:], progress, cancelled)
+                    else:
+                        self.post_message("Invalid command option")
+                if command == 'iocs':
+                    if args[0] in self.command_options[command] and len(args) > 1:
+                        if args[0] == 'lookup':
+                            matches = self.iris.lookup_ioc(args[1])
+                            if matches:
+                                self.post_table("Open cases matching {0}{1}".format(args[1], self.degraded('iris')),
+                                                ["IOC", "Cases"],
+                                                [(value, ', '.join(str(case_id) for case_id in sorted(case_ids)))
+                                                 for value, case_ids in sorted(matches.items())])
                             else:
-                                self.post_message("Failed to close all cases")
+                                self.post_message("No open cases match {0}".format(args[1]))
+                    else:
+                        self.post_message("Invalid command option")
+                if command == 'gpt':
+                    if args[0] in self.command_options[command]:
+                        if args[0] == 'stats':
+                            self.post_table("Model usage",
+                                            ["Model", "Requests", "Mean latency (s)", "Prompt tokens", "Completion tokens", "Escalations"],
+                                            [(model, requests, "{0:.2f}".format(latency), prompt, completion, escalations)
+                                             for model, requests, latency, prompt, completion, escalations in self.iris.g.model_stats()])
                     else:
                         self.post_message("Invalid command option")
                 if command == 'auth':
@@ -216,12 +517,31 @@ class MattermostMethods():
                 if command == 'howto':
                     if args[0] in self.command_options[command]:
                         if args[0] == 'commands':
-                            for command in self.command_options.keys():
-                                self.post_message("Command: /{0}".format(command))
-                                for option in self.command_options[command]:
-                                    self.post_message("- Option: {0}".format(option))
+                            self.post_table("Commands",
+                                            ["Command", "Options"],
+                                            [("/" + name, ', '.join(options)) for name, options in self.command_options.items()])
                         else:
                             self.post_message("Invalid command option")
+                if command == 'jobs':
+                    if args[0] in self.command_options[command]:
+                        if args[0] == 'list':
+                            self.post_table("Jobs",
+                                            ["Job", "Status", "Command", "Progress"],
+                                            [(job.id, job.status, job.description,
+                                              "{0}/{1}".format(job.done, job.total) if job.total else "")
+                                             for job in self.jobs.list_jobs()])
+                        elif args[0] == 'cancel' and args[1].isdigit():
+                            if self.jobs.cancel(args[1]):
+                                self.post_message("Job {0} cancellation requested".format(args[1]))
+                            else:
+                                self.post_message("Job {0} is not active".format(args[1]))
+                        else:
+                            self.post_message("Invalid command option")
+                if command == 'health':
+                    if not args or args[0] in self.command_options[command]:
+                        self.post_health()
+                    else:
+                        self.post_message("Invalid command option")
                 if command == 'shutdown':
                     if args[0] in self.command_options[command]:
                         if args[0] == 'now':
@@ -230,9 +550,13 @@ class MattermostMethods():
                         else:
                             self.post_message("Invalid command option")
             else:
+                metrics.command_errors.inc(command='invalid')
                 self.post_message("Invalid command")
         except Exception as e:
+            metrics.command_errors.inc(command=label)
             logging.exception("Error handling command: {0}".format(e))
+        finally:
+            metrics.command_latency.observe(time.perf_counter() - started, command=label, option=option)
 
 
     
@@ -0,0 +1,205 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import logging
+import bisect
+import yaml
+import os
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{0}="{1}"'.format(name, value))
+    return '{' + ','.join(pairs) + '}'
+
+class Metric():
+    """ Base class for a labelled metric family """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self) -> list:
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} {1}'.format(self.name, self.kind)]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append('{0}{1} {2}'.format(self.name, format_labels(self.labels, key), value))
+        return lines
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = None
+
+    def set(self, value, **labels) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function) -> None:
+        """ Compute the unlabelled value at scrape time """
+        self.function = function
+
+    def render(self) -> list:
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logging.exception("Error computing {0}: {1}".format(self.name, e))
+        return super().render()
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                counts[position] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> list:
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} histogram'.format(self.name)]
+        names = self.labels + ('le',)
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{0}_bucket{1} {2}'.format(self.name, format_labels(names, key + (bound,)), cumulative))
+                lines.append('{0}_bucket{1} {2}'.format(self.name, format_labels(names, key + ('+Inf',)), count))
+                lines.append('{0}_sum{1} {2}'.format(self.name, format_labels(self.labels, key), total))
+                lines.append('{0}_count{1} {2}'.format(self.name, format_labels(self.labels, key), count))
+        return lines
+
+class Registry():
+    """ Collection of metrics rendered in the Prometheus text exposition format """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric) -> Metric:
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+backend_latency = REGISTRY.register(Histogram('triage_backend_request_seconds',
+                                              'Backend HTTP request latency',
+                                              ('backend', 'method', 'endpoint', 'status')))
+backend_errors = REGISTRY.register(Counter('triage_backend_errors_total',
+                                           'Backend requests that raised before a response',
+                                           ('backend', 'endpoint')))
+poll_duration = REGISTRY.register(Histogram('triage_poll_duration_seconds',
+                                            'Time spent in one mention poll or event drain'))
+poll_lag = REGISTRY.register(Gauge('triage_poll_lag_seconds',
+                                   'Seconds since the poll loop last completed a cycle'))
+mention_latency = REGISTRY.register(Histogram('triage_mention_response_seconds',
+                                              'Time from a mention being posted to the bot responding',
+                                              ('command',)))
+commands = REGISTRY.register(Counter('triage_commands_total',
+                                     'Commands received',
+                                     ('command', 'option')))
+command_errors = REGISTRY.register(Counter('triage_command_errors_total',
+                                           'Commands that failed or were invalid',
+                                           ('command',)))
+command_latency = REGISTRY.register(Histogram('triage_command_seconds',
+                                              'Command execution time',
+                                              ('command', 'option')))
+circuit_state = REGISTRY.register(Gauge('triage_circuit_state',
+                                       'Backend circuit breaker state: 0 closed, 1 half-open, 2 open',
+                                       ('backend',)))
+queue_depth = REGISTRY.register(Gauge('triage_job_queue_depth',
+                                      'Jobs waiting for a worker'))
+gpt_tokens = REGISTRY.register(Counter('triage_gpt_tokens_total',
+                                       'OpenAI tokens consumed',
+                                       ('model', 'kind')))
+gpt_latency = REGISTRY.register(Histogram('triage_gpt_request_seconds',
+                                          'OpenAI completion latency',
+                                          ('model',)))
+gpt_escalations = REGISTRY.register(Counter('triage_gpt_escalations_total',
+                                            'Completions re-run on the strong model',
+                                            ('reason',)))
+
+def make_handler(registry):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+def serve(host='127.0.0.1', port=9464, registry=REGISTRY) -> ThreadingHTTPServer:
+    """ Serve /metrics on a background thread """
+    server = ThreadingHTTPServer((host, port), make_handler(registry))
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info("Metrics available at http://{0}:{1}/metrics".format(host, server.server_port))
+    return server
+
+def serve_from_config():
+    """ Start the metrics endpoint if configuration/metrics.yaml enables it """
+    try:
+        if not os.path.exists('configuration/metrics.yaml'):
+            return None
+        with open('configuration/metrics.yaml', 'r') as f:
+            config = (yaml.safe_load(f) or {}).get('metrics') or {}
+        if not config.get('enabled', False):
+            return None
+        return serve(config.get('host', '127.0.0.1'), config.get('port', 9464))
+    except Exception as e:
+        logging.exception("Failed to start metrics endpoint")
+        return None
@@ -0,0 +1,89 @@
+import time
+
+def escape_cell(value) -> str:
+    """ Make a value safe to place inside a Markdown table cell """
+    return str(value).replace('|', '\\|').replace('\r', ' ').replace('\n', ' ')
+
+def markdown_table(headers, rows) -> list:
+    """ Render headers and rows as a list of Markdown table lines """
+    lines = ['| ' + ' | '.join(escape_cell(h) for h in headers) + ' |',
+             '|' + '|'.join(' --- ' for _ in headers) + '|']
+    for row in rows:
+        lines.append('| ' + ' | '.join(escape_cell(cell) for cell in row) + ' |')
+    return lines
+
+def chunk_table(title, headers, rows, limit) -> list:
+    """ Split a Markdown table into as few messages as fit within limit characters,
+        repeating the title and header in each message """
+    table = markdown_table(headers, rows)
+    head = ([title] if title else []) + table[:2]
+    head_size = sum(len(line) + 1 for line in head)
+    messages = []
+    body = []
+    size = head_size
+    for line in table[2:]:
+        if len(line) + head_size >= limit:
+            line = line[:max(0, limit - head_size - 4)] + '... |'
+        if body and size + len(line) + 1 > limit:
+            messages.append('\n'.join(head + body))
+            body = []
+            size = head_size
+        body.append(line)
+        size += len(line) + 1
+    if body or not messages:
+        messages.append('\n'.join(head + body))
+    return messages
+
+def chunk_text(text, limit) -> list:
+    """ Split plain text into messages of at most limit characters, preferring line breaks """
+    messages = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        messages.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    messages.append(text)
+    return messages
+
+class StreamRelay():
+    """ Keeps a single chat post updated with streamed text, throttled to one edit per interval """
+
+    def __init__(self, post, update, header='', interval=1.0, limit=16383):
+        self.post = post
+        self.update = update
+        self.header = header
+        self.interval = interval
+        self.limit = limit
+        self.post_id = None
+        self.text = ''
+        self.last_edit = 0.0
+
+    def __call__(self, text) -> None:
+        self.text = text
+        if time.monotonic() - self.last_edit >= self.interval:
+            self.publish(self.render(text))
+
+    def render(self, text) -> str:
+        message = self.header + text
+        if len(message) > self.limit:
+            message = message[:self.limit - 4] + ' ...'
+        return message
+
+    def publish(self, message) -> None:
+        self.last_edit = time.monotonic()
+        if self.post_id is None:
+            self.post_id = self.post(message)
+        else:
+            self.update(self.post_id, message)
+
+    def finish(self, text=None) -> None:
+        """ Publish the complete text, continuing in new posts past the size limit """
+        if text is not None:
+            self.text = text
+        if not self.text:
+            return
+        chunks = chunk_text(self.header + self.text, self.limit)
+        self.publish(chunks[0])
+        for chunk in chunks[1:]:
+            self.post(chunk)
@@ -0,0 +1,171 @@
+from email.utils import parsedate_to_datetime
+import threading
+import time
+import re
+
+class TokenBucket():
+    """ Thread-safe token bucket refilled at rate tokens per second, holding at most burst tokens """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1, deadline=None) -> bool:
+        """ Block until tokens are available, then take them; False if they would not be before deadline """
+        if self.rate <= 0:
+            return True
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def debit(self, tokens) -> None:
+        """ Take tokens without waiting, allowing the bucket to go into deficit """
+        with self.lock:
+            self.refill()
+            self.tokens -= tokens
+
+    def limit_to(self, remaining) -> None:
+        """ Never hold more tokens than the server says remain """
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, float(remaining))
+
+def parse_duration(value) -> float:
+    """ Parse OpenAI-style reset durations such as '20ms', '1s' or '6m0.5s' into seconds """
+    value = str(value).strip()
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        total += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total
+
+def parse_retry_after(value) -> float:
+    """ Parse a Retry-After header given as seconds or an HTTP date """
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+class AdaptiveConcurrency():
+    """ AIMD concurrency limit: grows by one per window of successes, halves on throttling """
+
+    def __init__(self, maximum=8, minimum=1):
+        self.maximum = max(1, int(maximum))
+        self.minimum = max(1, min(int(minimum), self.maximum))
+        self.limit = float(self.maximum)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline=None) -> bool:
+        with self.condition:
+            while self.active >= int(self.limit):
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.active += 1
+            return True
+
+    def release(self, throttled=False) -> None:
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(float(self.minimum), self.limit / 2)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / max(1.0, self.limit))
+            self.condition.notify_all()
+
+class BackendLimiter():
+    """ Request and token budgets plus adaptive concurrency for one backend """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_concurrency=8, min_concurrency=1):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute / 60.0, burst=requests_per_minute or None) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, burst=tokens_per_minute or None) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency)
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def block_for(self, seconds) -> None:
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def pause(self) -> float:
+        """ Seconds left of the current server-imposed pause """
+        with self.lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def acquire(self, tokens=0, deadline=None) -> bool:
+        """ Wait for any server-imposed pause, then for request, token and concurrency budget.
+            Returns False without a concurrency slot if that would take past deadline. """
+        while True:
+            wait = self.pause()
+            if wait <= 0:
+                break
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+        if self.requests is not None and not self.requests.acquire(deadline=deadline):
+            return False
+        if self.tokens is not None and tokens and not self.tokens.acquire(tokens, deadline):
+            return False
+        return self.concurrency.acquire(deadline)
+
+    def release(self, response=None, tokens=0, used_tokens=None) -> bool:
+        """ Learn from a response's status and rate-limit headers; returns True if it was throttled """
+        throttled = response is not None and response.status_code == 429
+        try:
+            if response is not None:
+                self.observe(response.headers, throttled)
+            if self.tokens is not None and used_tokens is not None and used_tokens > tokens:
+                self.tokens.debit(used_tokens - tokens)
+        finally:
+            self.concurrency.release(throttled)
+        return throttled
+
+    def observe(self, headers, throttled) -> None:
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if throttled:
+            self.block_for(retry_after or 1.0)
+        for kind, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            remaining = headers.get('x-ratelimit-remaining-{0}'.format(kind))
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if bucket is not None:
+                bucket.limit_to(remaining)
+            if remaining <= 0:
+                self.block_for(parse_duration(headers.get('x-ratelimit-reset-{0}'.format(kind), '1s')))
@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from methods.cache import digest
+from methods.gpt import estimate_tokens
+import threading
+import logging
+import sqlite3
+import heapq
+import time
+import yaml
+import os
+
+class Scheduler():
+    """ Periodically annotates open cases that are new or whose evidence changed, highest severity and oldest first """
+
+    def __init__(self, iris, notify=None):
+        self.iris = iris
+        self.notify = notify
+        self.enabled = False
+        self.interval = 900
+        self.token_budget = 200000
+        self.state_path = ''
+        self.skip_existing = True
+        self.load_config()
+        self.annotated = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.db = None
+        if self.state_path:
+            self.db = sqlite3.connect(self.state_path, check_same_thread=False)
+            with self.db:
+                self.db.execute("CREATE TABLE IF NOT EXISTS annotated "
+                                "(case_id INTEGER PRIMARY KEY, evidence_hash TEXT, annotated_at REAL)")
+            for case_id, evidence_hash in self.db.execute("SELECT case_id, evidence_hash FROM annotated"):
+                self.annotated[case_id] = evidence_hash
+        if self.enabled:
+            threading.Thread(target=self.run, name="scheduler", daemon=True).start()
+
+    def load_config(self) -> None:
+        """ Load scheduler configuration """
+        try:
+            if os.path.exists('configuration/scheduler.yaml'):
+                with open('configuration/scheduler.yaml', 'r') as f:
+                    config = (yaml.safe_load(f) or {}).get('scheduler') or {}
+                    self.enabled = config.get('enabled', self.enabled)
+                    self.interval = config.get('interval', self.interval)
+                    self.token_budget = config.get('token_budget', self.token_budget)
+                    self.state_path = config.get('state_path', self.state_path)
+                    self.skip_existing = config.get('skip_existing', self.skip_existing)
+        except Exception as e:
+            logging.exception("Failed to load scheduler configuration")
+
+    def record(self, case_id, evidence_hash) -> None:
+        with self.lock:
+            self.annotated[case_id] = evidence_hash
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("INSERT OR REPLACE INTO annotated (case_id, evidence_hash, annotated_at) VALUES (?, ?, ?)",
+                                    (case_id, evidence_hash, time.time()))
+
+    def changed_cases(self, cases) -> dict:
+        """ Fetch evidence for open cases and return {case_id: (evidence, hash)} for those new or changed """
+        with ThreadPoolExecutor(max_workers=max(1, int(self.iris.workers))) as pool:
+            evidence = dict(zip([case['case_id'] for case in cases],
+                                pool.map(self.iris.get_case_evidence, [case['case_id'] for case in cases])))
+        changed = {}
+        for case_id, text in evidence.items():
+            if not text:
+                continue
+            evidence_hash = digest(text)
+            with self.lock:
+                previous = self.annotated.get(case_id)
+            if previous == evidence_hash:
+                continue
+            if previous is None and self.skip_existing:
+                try:
+                    existing = self.iris.has_commentary(case_id)
+                except Exception as e:
+                    # Skip just this case; it is checked again on the next run
+                    logging.exception("Error checking commentary on case {0}: {1}".format(case_id, e))
+                    continue
+                if existing:
+                    # Annotated before the scheduler first saw it; only re-annotate once its evidence changes
+                    self.record(case_id, evidence_hash)
+                    continue
+            changed[case_id] = (text, evidence_hash)
+        return changed
+
+    def run_once(self) -> dict:
+        """ Annotate changed cases in priority order until the token budget is spent """
+        results = {}
+        self.iris.sync_cases()
+        cases = {case['case_id']: case for case in self.iris.index.query(state='Open')}
+        changed = self.changed_cases(list(cases.values()))
+        queue = [(-(cases[case_id].get('severity_rank') or 0), cases[case_id]['open_date'], case_id)
+                 for case_id in changed]
+        heapq.heapify(queue)
+        selected = []
+        spent = 0
+        while queue:
+            case_id = queue[0][2]
+            cost = estimate_tokens(changed[case_id][0]) + self.iris.g.completion_allowance
+            if selected and self.token_budget and spent + cost > self.token_budget:
+                break
+            heapq.heappop(queue)
+            selected.append(case_id)
+            spent += cost
+        if not selected:
+            return results
+        logging.info("Scheduled annotation of {0} changed cases (~{1} tokens), {2} deferred".format(
+            len(selected), spent, len(queue)))
+        with ThreadPoolExecutor(max_workers=max(1, int(self.iris.workers))) as pool:
+            futures = {pool.submit(self.iris.annotate_evidence, case_id, changed[case_id][0]): case_id
+                       for case_id in selected}
+            for future in as_completed(futures):
+                case_id = futures[future]
+                try:
+                    results[case_id] = bool(future.result())
+                except Exception as e:
+                    logging.exception("Error annotating case {0}: {1}".format(case_id, e))
+                    results[case_id] = False
+                if results[case_id]:
+                    self.record(case_id, changed[case_id][1])
+        annotated = sum(1 for ok in results.values() if ok)
+        if self.notify:
+            message = "Auto-annotated {0} of {1} new or changed cases".format(annotated, len(selected))
+            if queue:
+                message += "; {0} deferred to the next run by the token budget".format(len(queue))
+            self.notify(message)
+        return results
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.exception("Scheduled annotation failed: {0}".format(e))
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
@@ -0,0 +1,68 @@
+from collections import defaultdict
+import hashlib
+import random
+import re
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Only timestamps and sequence IDs are masked; addresses, ports and hashes are what tell two cases apart
+VOLATILE = re.compile(r'\b\d{4}-\d{2}-\d{2}(?:[t ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:z|[+-]\d{2}:?\d{2})?)?\b'
+                      r'|\b\d{2}:\d{2}:\d{2}(?:\.\d+)?\b'
+                      r'|\b(?:alert|case|event|record|request|seq|sequence|id)(?:[ _]?id)?[ =:#]*\d+\b'
+                      r'|#\d+\b')
+WORD = re.compile(r'[\w#.:/-]+')
+
+def stable_hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=4).digest(), 'big')
+
+def features(text, iocs=None, size=3) -> set:
+    """ Word shingles of evidence text with timestamps and sequence IDs masked, plus the case's IOC values """
+    words = WORD.findall(VOLATILE.sub('#', str(text or '').lower()))
+    shingles = {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))} if words else set()
+    shingles.update('ioc:' + str(value).strip().lower() for value in (iocs or ()))
+    return shingles
+
+class MinHasher():
+    """ MinHash signatures whose agreement rate estimates Jaccard similarity """
+
+    def __init__(self, num_perm=64, seed=1):
+        generator = random.Random(seed)
+        self.permutations = [(generator.randrange(1, MERSENNE_PRIME), generator.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, shingles) -> tuple:
+        hashes = [stable_hash(shingle) for shingle in shingles]
+        if not hashes:
+            return tuple(MAX_HASH for _ in self.permutations)
+        return tuple(min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in self.permutations)
+
+def similarity(first, second) -> float:
+    """ Estimated Jaccard similarity of two signatures """
+    return sum(1 for a, b in zip(first, second) if a == b) / max(1, len(first))
+
+def cluster(signatures, bands=8, threshold=0.8) -> list:
+    """ Group keys whose signatures collide in an LSH band and agree above threshold; singletons included """
+    rows = max(1, len(next(iter(signatures.values()), ())) // bands)
+    buckets = defaultdict(list)
+    for key, signature in signatures.items():
+        for band in range(bands):
+            buckets[(band, signature[band * rows:(band + 1) * rows])].append(key)
+    parent = {key: key for key in signatures}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    # Compare each bucket against its first member rather than pairwise, so a bucket of n exact
+    # repeats costs n comparisons instead of n squared
+    for keys in buckets.values():
+        anchor = keys[0]
+        for other in keys[1:]:
+            if find(anchor) != find(other) and similarity(signatures[anchor], signatures[other]) >= threshold:
+                parent[find(other)] = find(anchor)
+    groups = defaultdict(list)
+    for key in signatures:
+        groups[find(key)].append(key)
+    return [sorted(members) for members in groups.values()]
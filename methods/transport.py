@@ -0,0 +1,261 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+from methods.ratelimit import BackendLimiter
+from methods.breaker import CircuitBreaker, CircuitOpenError
+from methods import metrics
+import threading
+import requests
+import logging
+import time
+import re
+import yaml
+import os
+
+DEFAULTS = {
+    'pool_size': 10,
+    'connect_timeout': 5,
+    'read_timeout': 120,
+    'retries': 3,
+    'backoff_factor': 0.5,
+    'status_forcelist': [500, 502, 503, 504],
+    'limits': {},
+    'deadlines': {},
+    'breaker': {'failure_threshold': 5, 'recovery_time': 30},
+}
+
+ID_SEGMENT = re.compile(r'^(\d+|[a-z0-9]{26}|[0-9a-f-]{32,36}|(file|batch|chatcmpl)-[\w-]+)$')
+
+def base_url(fqdn) -> str:
+    """ https://<fqdn>, unless the configured value already carries a scheme """
+    fqdn = str(fqdn).rstrip('/')
+    return fqdn if '://' in fqdn else "https://{0}".format(fqdn)
+
+def endpoint_label(url) -> str:
+    """ URL path with IDs collapsed, so metric labels stay low-cardinality """
+    path = urlsplit(url).path
+    return '/'.join(':id' if ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+class CachedJSONResponse(requests.Response):
+    """ Response whose JSON body is decoded at most once """
+
+    def json(self, **kwargs):
+        if not hasattr(self, '_json_cache'):
+            self._json_cache = super().json(**kwargs)
+        return self._json_cache
+
+def _cache_json(response, *args, **kwargs):
+    response.__class__ = CachedJSONResponse
+    return response
+
+class Transport():
+    """ Pooled, keep-alive HTTP sessions shared by every backend, one per host """
+
+    def __init__(self):
+        self.settings = dict(DEFAULTS)
+        self.sessions = {}
+        self.limiters = {}
+        self.breakers = {}
+        self.unauthorized = {}
+        self.lock = threading.Lock()
+        self.load_config()
+
+    def load_config(self) -> None:
+        """ Load transport configuration, falling back to defaults """
+        try:
+            if os.path.exists('configuration/transport.yaml'):
+                with open('configuration/transport.yaml', 'r') as f:
+                    config = yaml.safe_load(f) or {}
+                    self.settings.update(config.get('transport') or {})
+        except Exception as e:
+            logging.exception("Failed to load transport configuration")
+
+    def session_for(self, url) -> requests.Session:
+        """ Return the pooled session for the host of a URL """
+        parts = urlsplit(url)
+        host = "{0}://{1}".format(parts.scheme, parts.netloc)
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.build_session(host)
+                self.sessions[host] = session
+            return session
+
+    def build_session(self, host) -> requests.Session:
+        retry = Retry(total=self.settings['retries'],
+                      connect=self.settings['retries'],
+                      read=0,
+                      status=self.settings['retries'],
+                      backoff_factor=self.settings['backoff_factor'],
+                      status_forcelist=[code for code in self.settings['status_forcelist'] if code != 429],
+                      # Status retries only for idempotent methods; connect errors are retried for every method
+                      allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                      # Retry-After would make urllib3 retry a 429 inside the adapter; send() owns 429s
+                      respect_retry_after_header=False,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.settings['pool_size'],
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount(host, adapter)
+        session.hooks['response'].append(_cache_json)
+        return session
+
+    def limiter_for(self, backend) -> BackendLimiter:
+        """ Return the rate limiter shared by every call to a backend """
+        with self.lock:
+            limiter = self.limiters.get(backend)
+            if limiter is None:
+                limits = (self.settings.get('limits') or {}).get(backend) or {}
+                limiter = BackendLimiter(backend, **limits)
+                self.limiters[backend] = limiter
+            return limiter
+
+    def breaker_for(self, backend) -> CircuitBreaker:
+        """ Return the circuit breaker guarding a backend """
+        with self.lock:
+            breaker = self.breakers.get(backend)
+            if breaker is None:
+                breaker = CircuitBreaker(backend, **(self.settings.get('breaker') or {}))
+                self.breakers[backend] = breaker
+            return breaker
+
+    def available(self, backend) -> bool:
+        """ False while a backend's circuit is open and not yet due for a recovery probe """
+        return self.breaker_for(backend).available()
+
+    def health(self) -> list:
+        """ Circuit state of every backend called so far """
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return [breaker.describe() for breaker in sorted(breakers, key=lambda breaker: breaker.name)]
+
+    def deadline_for(self, backend) -> float:
+        """ Seconds a call to a backend may take in total, including 429 retries """
+        return (self.settings.get('deadlines') or {}).get(backend, self.settings['read_timeout'])
+
+    def on_unauthorized(self, backend, callback) -> None:
+        """ Register a callback that returns refreshed auth headers when a backend answers 401 or 403 """
+        with self.lock:
+            self.unauthorized[backend] = callback
+
+    def used_tokens(self, response, stream):
+        """ Tokens a completion actually consumed, when the response reports them """
+        if response is None or stream or 'json' not in response.headers.get('Content-Type', ''):
+            return None
+        try:
+            return (response.json().get('usage') or {}).get('total_tokens')
+        except Exception:
+            return None
+
+    def request(self, method, url, backend=None, tokens=0, **kwargs) -> requests.Response:
+        """ Send a request, retrying once with refreshed credentials if the backend rejects them """
+        response = self.send(method, url, backend, tokens, **kwargs)
+        if response.status_code not in (401, 403):
+            return response
+        with self.lock:
+            callback = self.unauthorized.get(backend)
+        if callback is None:
+            return response
+        try:
+            headers = callback()
+        except Exception as e:
+            logging.exception("Failed to refresh {0} credentials".format(backend))
+            headers = None
+        if not headers:
+            return response
+        logging.info("{0} rejected its credentials, retrying with a refreshed secret".format(backend))
+        response.close()
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **headers)
+        return self.send(method, url, backend, tokens, **kwargs)
+
+    def send(self, method, url, backend=None, tokens=0, **kwargs) -> requests.Response:
+        """ Send a request through the backend's circuit breaker and rate limiter within its deadline,
+            retrying 429s after the server's pause """
+        deadline = time.monotonic() + self.deadline_for(backend)
+        timeout = kwargs.pop('timeout', None)
+        session = self.session_for(url)
+        limiter = self.limiter_for(backend) if backend else None
+        breaker = self.breaker_for(backend) if backend else None
+        attempts = self.settings['retries'] + 1
+        throttled = None
+        for attempt in range(attempts):
+            if limiter and not limiter.acquire(tokens, deadline):
+                # Waiting out the limiter would overrun the deadline; that is throttling, not a backend failure
+                if throttled is not None:
+                    return throttled
+                raise requests.exceptions.Timeout("{0} rate limit wait would exceed its deadline".format(backend))
+            if breaker and not breaker.allow():
+                if limiter:
+                    limiter.release(None, tokens)
+                raise CircuitOpenError("{0} is unavailable (circuit open)".format(backend))
+            if throttled is not None:
+                throttled.close()
+                throttled = None
+            response = None
+            remaining = max(0.001, deadline - time.monotonic())
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url,
+                                           timeout=timeout or (min(self.settings['connect_timeout'], remaining), remaining),
+                                           **kwargs)
+            except Exception as e:
+                metrics.backend_errors.inc(backend=backend or '', endpoint=endpoint_label(url))
+                if breaker:
+                    breaker.record_failure(e)
+                raise
+            finally:
+                if limiter:
+                    limiter.release(response, tokens, self.used_tokens(response, kwargs.get('stream')))
+            if breaker:
+                if response.status_code >= 500:
+                    breaker.record_failure("HTTP {0}".format(response.status_code))
+                else:
+                    breaker.record_success()
+            metrics.backend_latency.observe(time.perf_counter() - started,
+                                            backend=backend or '',
+                                            method=method,
+                                            endpoint=endpoint_label(url),
+                                            status=response.status_code)
+            if response.status_code != 429 or attempt == attempts - 1:
+                return response
+            # Only retry if the server's pause ends before the deadline; otherwise hand the 429 back now
+            if time.monotonic() + (limiter.pause() if limiter else 0) >= deadline:
+                return response
+            logging.info("{0} rate limited, retrying".format(backend or url))
+            throttled = response
+        return response
+
+class Client():
+    """ Backend-scoped view of the shared transport """
+
+    def __init__(self, name, transport):
+        self.name = name
+        self.transport = transport
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        return self.transport.request(method, url, backend=self.name, **kwargs)
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> Transport:
+    """ Return the process-wide transport, creating it on first use """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+def client(name) -> Client:
+    """ Return an HTTP client for the named backend """
+    return Client(name, get_transport())
@@ -1,7 +1,11 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from methods import transport
+import threading
 import logging
 import urllib3
 import yaml
+import time
 import sys
 import os
 
@@ -13,6 +17,7 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 class VaultMethods():
 
     def __init__(self):
+        self.http = transport.client('vault')
         self.vault_url = ''
         self.vault_token = ''
         self.token_renew_buffer = 0
@@ -20,22 +25,41 @@ class VaultMethods():
         self.gpt_token_path = ""
         self.iris_key = ""
         self.gpt_key = ""
+        self.lease_manager = True
+        self.lease_check_interval = 300
+        self.secret_refresh = 3600
+        self.refresh_cooldown = 30
         self.load_config()
         self.headers = {
             'X-Vault-Token': self.vault_token
         }
+        self.lock = threading.Lock()
+        self.secrets = {}
+        self.watchers = defaultdict(list)
+        self.sealed = None
+        self.authenticated = False
+        self.token_ttl = 0
+        self.token_checked_at = 0
+        self.stopped = threading.Event()
         try:
-            if not self.is_authenticated():
+            authenticated, sealed = self.probe()
+            if not authenticated:
                 logging.info("Vault authentication failed")
                 sys.exit(1)
-            if self.check_seal_status():
+            if sealed is None:
+                logging.error("Failed to check vault seal status")
+                sys.exit(1)
+            if sealed:
                 logging.info("Vault is sealed")
                 sys.exit(1)
-            if self.check_token() < self.token_renew_buffer:
+            remaining = self.token_remaining()
+            if remaining is not None and remaining < self.token_renew_buffer:
                 self.renew_token()
         except Exception as e:
             logging.exception("Failed to communicate with vault")
             sys.exit(1)
+        if self.lease_manager:
+            threading.Thread(target=self.manage_leases, name="vault-leases", daemon=True).start()
 
     def load_config(self) -> None:
         '''Load vault configuration'''
@@ -45,12 +69,15 @@ class VaultMethods():
                 with open('configuration/vault.yaml', 'r') as f:
                     config = yaml.safe_load(f)
                     config = config['vault']
-                    self.vault_url = "https://{0}".format(config['fqdn'])
+                    self.vault_url = transport.base_url(config['fqdn'])
                     self.vault_token = config['token']
                     self.token_renew_buffer = config['buffer']
                     self.iris_token_path = config['iris_token_path']
                     self.mattermost_token_path = config['mattermost_token_path']
                     self.gpt_token_path = config['gpt_token_path']
+                    self.lease_manager = config.get('lease_manager', self.lease_manager)
+                    self.lease_check_interval = config.get('lease_check_interval', self.lease_check_interval)
+                    self.secret_refresh = config.get('secret_refresh', self.secret_refresh)
             else:
                 logging.error("Vault configuration file not found")
                 sys.exit(1)
@@ -58,100 +85,191 @@ class VaultMethods():
             logging.exception("Failed to load vault configuration")
             sys.exit(1)
 
-    def is_authenticated(self) -> bool:
-        '''Check if the client is authenticated'''
-        try:
-            response = requests.get(f"{self.vault_url}/v1/auth/token/lookup-self", headers=self.headers, verify=False)
-            return response.status_code == 200
-        except Exception as e:
-            logging.exception(e)
-            return False
-        
-    def check_token(self) -> int:
-        '''Check token TTL'''
+    def lookup_token(self):
+        '''Look up the token once, caching its authentication state and TTL'''
         try:
-            response = requests.get(f"{self.vault_url}/v1/auth/token/lookup-self", headers=self.headers, verify=False)
-            token = response.json()
-            return token['data']['ttl']
+            response = self.http.get(f"{self.vault_url}/v1/auth/token/lookup-self", headers=self.headers, verify=False)
+            with self.lock:
+                self.authenticated = response.status_code == 200
+                self.token_checked_at = time.time()
+                if self.authenticated:
+                    self.token_ttl = response.json()['data']['ttl']
+            return self.token_ttl if self.authenticated else None
         except Exception as e:
             logging.exception(e)
-            sys.exit(1)
+            return None
+
+    def probe(self) -> tuple:
+        '''Run the token lookup and seal check concurrently, prefetching backend secrets alongside'''
+        paths = [path for path in (self.iris_token_path, self.mattermost_token_path, self.gpt_token_path) if path]
+        with ThreadPoolExecutor(max_workers=2 + len(paths)) as pool:
+            lookup = pool.submit(self.lookup_token)
+            sealed = pool.submit(self.check_seal_status)
+            for path in paths:
+                pool.submit(self.retrieve_secret, path, None)
+            return lookup.result() is not None, sealed.result()
+
+    def token_remaining(self):
+        '''Seconds left on the token from cached state, or None if it does not expire'''
+        with self.lock:
+            if not self.token_ttl:
+                return None
+            return max(0, self.token_ttl - (time.time() - self.token_checked_at))
 
-    def check_seal_status(self) -> bool:
-        '''Check to see if the vault is sealed'''
+    def check_seal_status(self):
+        '''Check to see if the vault is sealed, caching the result; None if the check failed'''
         try:
-            response = requests.get(f"{self.vault_url}/v1/sys/seal-status", headers=self.headers, verify=False)
-            seal_status = response.json()
-            return seal_status['sealed']
+            response = self.http.get(f"{self.vault_url}/v1/sys/seal-status", headers=self.headers, verify=False)
+            sealed = response.json()['sealed']
+            with self.lock:
+                if sealed and not self.sealed:
+                    logging.error("Vault is sealed")
+                self.sealed = sealed
+            return sealed
         except Exception as e:
             logging.exception(e)
-            sys.exit(1)
+            return None
 
-    def renew_token(self) -> None:
-        '''Renew period token'''
+    def renew_token(self) -> bool:
+        """Renew period token"""
         try:
-            response = requests.post(f"{self.vault_url}/v1/auth/token/renew-self", headers=self.headers, verify=False)
-            renewal_response = response.json()
-            logging.info(renewal_response)
-            ttl = renewal_response['auth']['lease_duration']
+            response = self.http.post(url=f"{self.vault_url}/v1/auth/token/renew-self",
+                                     headers=self.headers,
+                                     verify=False)
+            if response.status_code != 200:
+                logging.error(f"Token renewal failed with status {response.status_code}")
+                return False
+            ttl = response.json()['auth']['lease_duration']
+            with self.lock:
+                self.authenticated = True
+                self.token_ttl = ttl
+                self.token_checked_at = time.time()
             logging.info(f"Token renewed. New TTL: {ttl} seconds")
+            return True
         except Exception as e:
             logging.exception(f"Error renewing token: {e}")
+            return False
 
-    def retrieve_iris_secrets(self) -> str:
-        '''Retrieve IRIS API token'''
+    def read_secret(self, path, force=False):
+        '''Return a KV v2 secret from the cache, reading it from Vault when missing, due or forced'''
+        with self.lock:
+            entry = self.secrets.get(path)
+        if entry and not force and time.time() < entry['refresh_at']:
+            return entry['data']
+        response = self.http.get(f"{self.vault_url}/v1/{path}", headers=self.headers, verify=False)
+        if response.status_code != 200:
+            logging.error(f"Reading {path} failed with status {response.status_code}")
+            return entry['data'] if entry else None
+        body = response.json()
+        metadata = body['data'].get('metadata') or {}
+        lease = body.get('lease_duration') or 0
+        now = time.time()
+        refreshed = {
+            'data': body['data']['data'],
+            'version': metadata.get('version'),
+            'created_time': metadata.get('created_time'),
+            'fetched_at': now,
+            'refresh_at': now + (max(lease - self.token_renew_buffer, lease / 2) if lease else self.secret_refresh),
+        }
+        with self.lock:
+            self.secrets[path] = refreshed
+            watchers = list(self.watchers[path])
+        if entry and (entry['version'], entry['data']) != (refreshed['version'], refreshed['data']):
+            logging.info(f"Secret {path} changed to version {refreshed['version']}")
+            for watcher in watchers:
+                try:
+                    watcher(refreshed['data'])
+                except Exception as e:
+                    logging.exception(f"Error applying rotated secret {path}: {e}")
+        return refreshed['data']
+
+    def retrieve_secret(self, path, field):
         try:
-            response = requests.get(f"{self.vault_url}/v1/{self.iris_token_path}", headers=self.headers, verify=False)
-            response = response.json()['data']['data']['token']
-            self.iris_key = response
-            return self.iris_key
+            data = self.read_secret(path)
+            return data if field is None else data[field]
         except Exception as e:
-            logging.exception(f"Error retrieving Iris secret: {e}")
+            logging.exception(f"Error retrieving secret {path}: {e}")
             return None
-        
+
+    def retrieve_iris_secrets(self) -> str:
+        '''Retrieve IRIS API token'''
+        self.iris_key = self.retrieve_secret(self.iris_token_path, 'token')
+        return self.iris_key
+
     def retrieve_gpt_secrets(self) -> str:
         '''Retrieve GPT API token'''
-        try:
-            response = requests.get(f"{self.vault_url}/v1/{self.gpt_token_path}", headers=self.headers, verify=False)
-            response = response.json()['data']['data']['key']
-            self.gpt_key = response
-            return self.gpt_key
-        except Exception as e:
-            logging.exception(f"Error retrieving GPT secret: {e}")
-            return None
-        
+        self.gpt_key = self.retrieve_secret(self.gpt_token_path, 'key')
+        return self.gpt_key
+
     def retrieve_mattermost_secrets(self) -> str:
         '''Retrieve Mattermost API token'''
-        try:
-            response = requests.get(f"{self.vault_url}/v1/{self.mattermost_token_path}", headers=self.headers, verify=False)
-            response = response.json()['data']['data']['key']
-            self.mattermost_key = response
-            return self.mattermost_key
-        except Exception as e:
-            logging.exception(f"Error retrieving Mattermost secret: {e}")
-            return None
-        
+        self.mattermost_key = self.retrieve_secret(self.mattermost_token_path, 'key')
+        return self.mattermost_key
+
+    def watch(self, backend, path, field, apply) -> None:
+        '''Re-apply a backend credential when its secret rotates or the backend rejects it'''
+        applied = {}
+
+        def rotated(data):
+            applied['headers'] = apply(data[field])
+
+        with self.lock:
+            self.watchers[path].append(rotated)
+
+        def unauthorized():
+            with self.lock:
+                entry = self.secrets.get(path)
+            if entry and time.time() - entry['fetched_at'] < self.refresh_cooldown:
+                return None
+            applied.clear()
+            self.read_secret(path, force=True)
+            return applied.get('headers')
+
+        transport.get_transport().on_unauthorized(backend, unauthorized)
+
+    def next_check(self) -> float:
+        '''Seconds until the token or a cached secret is due for renewal'''
+        delay = self.lease_check_interval
+        remaining = self.token_remaining()
+        if remaining is not None:
+            delay = min(delay, max(remaining - self.token_renew_buffer, remaining / 2))
+        with self.lock:
+            for entry in self.secrets.values():
+                delay = min(delay, entry['refresh_at'] - time.time())
+        return max(1.0, delay)
+
+    def manage_leases(self) -> None:
+        '''Renew the token ahead of its TTL and refresh cached secrets before they go stale'''
+        while not self.stopped.wait(self.next_check()):
+            try:
+                remaining = self.token_remaining()
+                if remaining is not None and remaining <= self.token_renew_buffer:
+                    if not self.renew_token():
+                        self.lookup_token()
+                else:
+                    self.lookup_token()
+                self.check_seal_status()
+                with self.lock:
+                    due = [path for path, entry in self.secrets.items() if time.time() >= entry['refresh_at']]
+                for path in due:
+                    self.read_secret(path, force=True)
+            except Exception as e:
+                logging.exception(f"Error managing vault leases: {e}")
+
+    def stop(self) -> None:
+        self.stopped.set()
+
     def auth_check(self) -> str:
-        """Check authentication status"""
-        try:
-            seal_status = self.check_seal_status()
-            auth_status = self.is_authenticated()
-            token_status = self.check_token()
-            response = f"Seal Status: {seal_status}\nAuth Status: {auth_status}\nToken TTL: {token_status}"
-            logging.info(response)
-            return response
-        except Exception as e:
-            return e
-        
-    def renew_token(self) -> None:
-        """Renew token"""
-        try:
-            response = requests.post(url=f"{self.vault_url}/v1/auth/token/renew-self",
-                                     headers=self.headers,
-                                     verify=False)
-            if response.status_code == 200:
-                return True
-            else:
-                return False
-        except Exception as e:
-            return False
\ No newline at end of file
+        """Report authentication status from cached state"""
+        with self.lock:
+            checked = int(time.time() - self.token_checked_at)
+            secrets = [f"{path}: v{entry['version']} ({int(time.time() - entry['fetched_at'])}s old)"
+                       for path, entry in sorted(self.secrets.items())]
+            authenticated = self.authenticated
+            sealed = self.sealed
+        remaining = self.token_remaining()
+        ttl = 'no expiry' if remaining is None else int(remaining)
+        response = f"Seal Status: {sealed}\nAuth Status: {authenticated}\nToken TTL: {ttl}\nChecked: {checked}s ago"
+        if secrets:
+            response += "\nSecrets:\n" + '\n'.join(secrets)
+        return response
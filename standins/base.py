@@ -0,0 +1,95 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import threading
+import logging
+import random
+import json
+import time
+
+class Faults():
+    """ Latency, failure and throttling injected into every stand-in response """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def delay(self) -> None:
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.jitter * (self.draw() * 2 - 1)))
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """ JSON request handler with fault injection; subclasses implement route() """
+
+    protocol_version = 'HTTP/1.1'
+    # Split header/body writes otherwise stall on Nagle plus delayed ACK, adding ~40ms per keep-alive request
+    disable_nagle_algorithm = True
+    state = None
+    faults = Faults()
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def send_json(self, status, body, headers=None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def read_json(self) -> dict:
+        body = self.read_body()
+        return json.loads(body) if body else {}
+
+    def handle_request(self, method) -> None:
+        self.faults.delay()
+        if self.faults.throttle_rate and self.faults.draw() < self.faults.throttle_rate:
+            self.read_body()
+            self.send_json(429, {'message': 'rate limited'}, {'Retry-After': self.faults.retry_after})
+            return
+        if self.faults.failure_rate and self.faults.draw() < self.faults.failure_rate:
+            self.read_body()
+            self.send_json(503, {'message': 'injected failure'})
+            return
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        segments = [segment for segment in parts.path.split('/') if segment]
+        try:
+            self.route(method, segments, query)
+        except Exception as e:
+            logging.exception("Stand-in error: {0}".format(e))
+            self.send_json(500, {'message': str(e)})
+
+    def route(self, method, segments, query) -> None:
+        self.send_json(404, {'message': 'not found'})
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+def serve(handler, state, faults=None, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    """ Start a stand-in server on a background thread """
+    handler = type(handler.__name__, (handler,), {'state': state, 'faults': faults or Faults()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,160 @@
+from standins.base import StandinHandler, Faults, serve
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+import itertools
+import threading
+import argparse
+import logging
+import random
+
+HOSTS = ['web01', 'db02', 'mail03', 'vpn04', 'dc05']
+# Default rows of the IRIS severities table; the IDs are not ordered by severity
+SEVERITIES = [(1, 'Medium'), (2, 'Unspecified'), (3, 'Informational'), (4, 'Low'), (5, 'High'), (6, 'Critical')]
+
+class IrisState():
+    """ Synthetic DFIR IRIS dataset: cases with evidence, IOCs and note directories """
+
+    def __init__(self, cases=100, evidence=5, iocs=10, customer='1', seed=0, duplicates=0.0):
+        generator = random.Random(seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.cases = {}
+        self.evidence = {}
+        self.iocs = {}
+        self.directories = {}
+        self.notes = {}
+        today = datetime(2025, 1, 1)
+        for case_id in range(1, cases + 1):
+            self.cases[case_id] = {
+                'case_id': case_id,
+                'case_name': "#{0} - Suspicious activity on {1}".format(case_id, generator.choice(HOSTS)),
+                'state_name': 'Open',
+                'customer_id': int(customer),
+                'client_name': "Customer {0}".format(customer),
+                'case_open_date': (today - timedelta(days=generator.randint(0, 365))).strftime('%m/%d/%Y'),
+                'severity': dict(zip(('severity_id', 'severity_name'), generator.choice(SEVERITIES))),
+            }
+            self.evidence[case_id] = [{
+                'id': n,
+                'filename': "evidence-{0}.log".format(n),
+                'file_description': "Alert {0}: {1}.internal.subterfuge.biz contacted 203.0.113.{2} over port {3}".format(
+                    n, generator.choice(HOSTS), generator.randint(1, 254), generator.choice([22, 443, 3389])),
+            } for n in range(evidence)]
+            self.iocs[case_id] = [{
+                'ioc_id': n,
+                'ioc_value': generator.choice(["198.51.100.{0}".format(generator.randint(1, 254)),
+                                               "malware{0}.example.com".format(generator.randint(1, 50)),
+                                               "{0:064x}".format(generator.getrandbits(256))]),
+                'ioc_type': 'other',
+            } for n in range(iocs)]
+            if case_id > 1 and generator.random() < duplicates:
+                # Repeat alert: same evidence and IOCs as an earlier case
+                original = generator.randint(1, case_id - 1)
+                self.evidence[case_id] = [dict(item) for item in self.evidence[original]]
+                self.iocs[case_id] = [dict(item) for item in self.iocs[original]]
+            self.directories[case_id] = []
+
+    def reopen(self) -> None:
+        with self.lock:
+            for case in self.cases.values():
+                case['state_name'] = 'Open'
+
+    def open_cases(self, customer=None) -> list:
+        with self.lock:
+            return [dict(case) for case in self.cases.values()
+                    if case['state_name'] == 'Open' and (not customer or str(case['customer_id']) == str(customer))]
+
+class IrisHandler(StandinHandler):
+
+    def ok(self, data) -> None:
+        self.send_json(200, {'status': 'success', 'message': '', 'data': data})
+
+    def case_id(self, query) -> int:
+        return int(query.get('cid', 0))
+
+    def route(self, method, segments, query) -> None:
+        state = self.state
+        if segments == ['manage', 'cases', 'list']:
+            with state.lock:
+                self.ok([dict(case) for case in state.cases.values()])
+        elif segments == ['manage', 'cases', 'filter']:
+            cases = state.open_cases(query.get('case_customer_id'))
+            page = int(query.get('page', 1))
+            per_page = int(query.get('per_page', 100))
+            chunk = cases[(page - 1) * per_page:page * per_page]
+            last_page = max(1, (len(cases) + per_page - 1) // per_page)
+            self.ok({'total': len(cases), 'cases': chunk, 'current_page': page, 'last_page': last_page,
+                     'next_page': page + 1 if page < last_page else None})
+        elif segments[:3] == ['manage', 'cases', 'close'] and method == 'POST':
+            with state.lock:
+                case = state.cases.get(int(segments[3]))
+                if case is None:
+                    self.send_json(400, {'status': 'error', 'message': 'Unknown case'})
+                    return
+                case['state_name'] = 'Closed'
+                self.ok(dict(case))
+        elif segments == ['case', 'evidences', 'list']:
+            self.ok({'evidences': state.evidence.get(self.case_id(query), [])})
+        elif segments == ['case', 'ioc', 'list']:
+            self.ok({'ioc': state.iocs.get(self.case_id(query), [])})
+        elif segments == ['case', 'notes', 'directories', 'filter']:
+            with state.lock:
+                directories = state.directories.get(self.case_id(query), [])
+                self.ok([{'id': d['id'], 'name': d['name'],
+                          'notes': [{'id': n, 'title': state.notes[n]['note_title']} for n in d['notes']]}
+                         for d in directories])
+        elif segments == ['case', 'notes', 'directories', 'add'] and method == 'POST':
+            body = self.read_json()
+            with state.lock:
+                directory = {'id': next(state.ids), 'name': body['name'], 'notes': []}
+                state.directories.setdefault(int(body['cid']), []).append(directory)
+            self.ok({'id': directory['id'], 'name': directory['name']})
+        elif segments == ['case', 'notes', 'add'] and method == 'POST':
+            body = self.read_json()
+            now = datetime.now().isoformat()
+            with state.lock:
+                note_id = next(state.ids)
+                state.notes[note_id] = {'note_id': note_id, 'note_title': body['note_title'],
+                                        'note_content': body['note_content'], 'directory_id': body['directory_id'],
+                                        'note_creationdate': now, 'note_lastupdate': now}
+                for directory in state.directories.get(int(body['cid']), []):
+                    if directory['id'] == body['directory_id']:
+                        directory['notes'].append(note_id)
+            self.ok(dict(state.notes[note_id]))
+        elif segments[:2] == ['case', 'notes'] and len(segments) == 4 and segments[3] == 'update':
+            body = self.read_json()
+            with state.lock:
+                note = state.notes.get(int(segments[2]))
+                if note is None:
+                    self.send_json(404, {'status': 'error', 'message': 'Unknown note'})
+                    return
+                note.update(note_title=body['note_title'], note_content=body['note_content'],
+                            note_lastupdate=datetime.now().isoformat())
+            self.ok(dict(note))
+        elif segments[:2] == ['case', 'notes'] and len(segments) == 3 and segments[2].isdigit():
+            note = state.notes.get(int(segments[2]))
+            if note is None:
+                self.send_json(404, {'status': 'error', 'message': 'Unknown note'})
+            else:
+                self.ok(dict(note))
+        else:
+            self.send_json(404, {'status': 'error', 'message': 'not found'})
+
+def start(state, faults=None, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    return serve(IrisHandler, state, faults, host, port)
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stand-in for the DFIR IRIS endpoints the bot uses")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cases', type=int, default=100)
+    parser.add_argument('--duplicates', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = start(IrisState(args.cases, duplicates=args.duplicates), Faults(args.latency, failure_rate=args.failure_rate,
+                                                throttle_rate=args.throttle_rate), args.host, args.port)
+    logging.info("IRIS stand-in listening on http://{0}:{1}".format(args.host, server.server_port))
+    threading.Event().wait()
@@ -0,0 +1,214 @@
+from standins.base import StandinHandler, Faults, serve
+from http.server import ThreadingHTTPServer
+import itertools
+import threading
+import argparse
+import hashlib
+import logging
+import select
+import socket
+import struct
+import base64
+import uuid
+import json
+import time
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class MattermostState():
+    """ In-memory Mattermost channel that records everything the bot posts and broadcasts 'posted' events """
+
+    def __init__(self, channel_id='channel', bot_id='bot'):
+        self.channel_id = channel_id
+        self.bot_id = bot_id
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.ids = itertools.count(1)
+        self.posts = {}
+        # Every 'posted' event in order; a connection's seq N is the Nth event after it was opened
+        self.events = []
+        self.connections = {}
+        self.sockets = set()
+
+    def add_post(self, message, user_id='analyst', file_ids=None) -> dict:
+        with self.lock:
+            post_id = "{0:026d}".format(next(self.ids))
+            now = int(time.time() * 1000)
+            post = {'id': post_id, 'channel_id': self.channel_id, 'user_id': user_id, 'message': message,
+                    'create_at': now, 'update_at': now, 'delete_at': 0, 'file_ids': file_ids or []}
+            self.posts[post_id] = post
+            self.events.append({'event': 'posted',
+                                'data': {'post': json.dumps(post), 'channel_type': 'O'},
+                                'broadcast': {'channel_id': self.channel_id}})
+            self.changed.notify_all()
+            return dict(post)
+
+    def bot_posts(self) -> list:
+        with self.lock:
+            return [dict(post) for post in self.posts.values() if post['user_id'] == self.bot_id]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.posts.clear()
+
+    def connect(self, connection_id='', sequence=0):
+        """ Resume a known connection from sequence, or open a new one; returns (connection_id, start, position, resumed) """
+        with self.lock:
+            start = self.connections.get(connection_id)
+            if start is not None and sequence >= 1 and start + sequence - 1 <= len(self.events):
+                return connection_id, start, start + sequence - 1, True
+            connection_id = uuid.uuid4().hex[:26]
+            self.connections[connection_id] = len(self.events)
+            return connection_id, len(self.events), len(self.events), False
+
+    def wait_events(self, position, timeout) -> list:
+        with self.changed:
+            if position >= len(self.events):
+                self.changed.wait(timeout)
+            return self.events[position:]
+
+    def drop_connections(self) -> None:
+        """ Cut every open WebSocket so clients reconnect and resume """
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class MattermostHandler(StandinHandler):
+
+    def send_frame(self, payload, opcode=1) -> None:
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x80 | opcode, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+        self.connection.sendall(header + payload)
+
+    def recv_exact(self, size) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data += chunk
+        return data
+
+    def read_frame(self):
+        """ Read one masked client frame, returning (opcode, payload) """
+        first, second = self.recv_exact(2)
+        length = second & 0x7f
+        if length == 126:
+            length = struct.unpack('!H', self.recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.recv_exact(8))[0]
+        mask = self.recv_exact(4) if second & 0x80 else b'\x00' * 4
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self.recv_exact(length)))
+        return first & 0x0f, payload
+
+    def websocket(self, query) -> None:
+        """ Minimal Mattermost WebSocket: hello, 'posted' events, auth replies, pings and resume """
+        state = self.state
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+            self.send_json(400, {'message': 'websocket upgrade required'})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        connection_id, start, position, resumed = state.connect(query.get('connection_id', ''),
+                                                                int(query.get('sequence_number') or 0))
+        sock = self.connection
+        with state.lock:
+            state.sockets.add(sock)
+        try:
+            hello = {'event': 'hello', 'data': {'connection_id': connection_id, 'server_version': 'stand-in'}}
+            if not resumed:
+                hello['seq'] = 0
+            self.send_frame(hello)
+            while True:
+                for event in state.wait_events(position, 0.1):
+                    position += 1
+                    self.send_frame(dict(event, seq=position - start))
+                if not select.select([sock], [], [], 0)[0]:
+                    continue
+                opcode, payload = self.read_frame()
+                if opcode == 8:
+                    self.send_frame(payload[:2], opcode=8)
+                    break
+                if opcode == 9:
+                    self.send_frame(payload, opcode=10)
+                elif opcode == 1:
+                    message = json.loads(payload or b'{}')
+                    if 'action' in message:
+                        self.send_frame({'status': 'OK', 'seq_reply': message.get('seq')})
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            with state.lock:
+                state.sockets.discard(sock)
+
+    def route(self, method, segments, query) -> None:
+        state = self.state
+        if segments[:2] != ['api', 'v4']:
+            self.send_json(404, {'message': 'not found'})
+            return
+        segments = segments[2:]
+        if segments == ['websocket'] and method == 'GET':
+            self.websocket(query)
+        elif segments == ['posts'] and method == 'POST':
+            body = self.read_json()
+            self.send_json(201, state.add_post(body.get('message', ''), state.bot_id, body.get('file_ids')))
+        elif segments[:1] == ['posts'] and segments[-1:] == ['patch']:
+            body = self.read_json()
+            with state.lock:
+                post = state.posts.get(segments[1])
+                if post is None:
+                    self.send_json(404, {'message': 'not found'})
+                    return
+                post['message'] = body.get('message', post['message'])
+                post['update_at'] = int(time.time() * 1000)
+            self.send_json(200, dict(post))
+        elif segments[:1] == ['channels'] and segments[2:] == ['posts']:
+            since = int(query.get('since', 0))
+            with state.lock:
+                posts = {post_id: dict(post) for post_id, post in state.posts.items() if post['update_at'] >= since}
+            order = sorted(posts, key=lambda post_id: posts[post_id]['create_at'], reverse=True)
+            self.send_json(200, {'order': order, 'posts': posts})
+        elif segments == ['files'] and method == 'POST':
+            self.read_body()
+            self.send_json(201, {'file_infos': [{'id': "file{0:022d}".format(next(state.ids))}]})
+        elif segments in (['users'], ['teams'], ['channels']):
+            self.send_json(200, [])
+        else:
+            self.send_json(404, {'message': 'not found'})
+
+def start(state, faults=None, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    return serve(MattermostHandler, state, faults, host, port)
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stand-in for the Mattermost REST and WebSocket endpoints the bot uses")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8065)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = start(MattermostState(), Faults(args.latency, failure_rate=args.failure_rate,
+                                             throttle_rate=args.throttle_rate), args.host, args.port)
+    logging.info("Mattermost stand-in listening on http://{0}:{1} (WebSocket at ws://{0}:{1}/api/v4/websocket)".format(
+        args.host, server.server_port))
+    threading.Event().wait()
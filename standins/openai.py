@@ -0,0 +1,151 @@
+from standins.base import StandinHandler, Faults, serve
+from http.server import ThreadingHTTPServer
+from email.parser import BytesParser
+from email.policy import HTTP
+import argparse
+import itertools
+import threading
+import logging
+import json
+import time
+import zlib
+
+class OpenAIState():
+    """ In-memory files and batches behind the stand-in OpenAI API """
+
+    def __init__(self, latency=0.0, batch_delay=0.0, investigate_rate=0.0):
+        self.latency = latency
+        self.batch_delay = batch_delay
+        self.investigate_rate = investigate_rate
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def new_id(self, prefix) -> str:
+        with self.lock:
+            return "{0}-{1}".format(prefix, next(self.ids))
+
+    def complete(self, body) -> dict:
+        """ Deterministic chat completion for a request body """
+        prompt = ' '.join(str(m.get('content', '')) for m in body.get('messages', []))
+        # A stable fraction of prompts come back as 'investigate', so model escalation can be exercised
+        verdict = 'investigate' if zlib.crc32(prompt.encode('utf-8')) % 1000 < self.investigate_rate * 1000 else 'close'
+        content = "Stand-in summary of {0} characters of evidence.\nrecommendation: {1}".format(len(prompt), verdict)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            'id': self.new_id('chatcmpl'),
+            'object': 'chat.completion',
+            'model': body.get('model', ''),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens,
+                      'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    def run_batch(self, batch_id) -> None:
+        time.sleep(self.batch_delay)
+        batch = self.batches[batch_id]
+        lines = []
+        for line in self.files[batch['input_file_id']].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({
+                'id': self.new_id('batch_req'),
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': self.complete(request['body'])},
+                'error': None,
+            }))
+        output_file_id = self.new_id('file')
+        self.files[output_file_id] = ('\n'.join(lines) + '\n').encode('utf-8')
+        batch['output_file_id'] = output_file_id
+        batch['request_counts'] = {'total': len(lines), 'completed': len(lines), 'failed': 0}
+        batch['status'] = 'completed'
+
+class OpenAIHandler(StandinHandler):
+
+    def send_stream(self, completion) -> None:
+        """ Replay a completion as chat.completion.chunk server-sent events """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        content = completion['choices'][0]['message']['content']
+        for word in content.split(' '):
+            chunk = {'id': completion['id'],
+                     'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'delta': {'content': word + ' '}}]}
+            self.wfile.write("data: {0}\n\n".format(json.dumps(chunk)).encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.state.latency / 10)
+        usage = {'id': completion['id'], 'object': 'chat.completion.chunk', 'choices': [], 'usage': completion['usage']}
+        self.wfile.write("data: {0}\n\n".format(json.dumps(usage)).encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def route(self, method, segments, query) -> None:
+        state = self.state
+        time.sleep(state.latency)
+        if method == 'GET' and segments[:2] == ['v1', 'models']:
+            self.send_json(200, {'data': [{'id': 'stand-in'}]})
+        elif method == 'GET' and segments[:2] == ['v1', 'batches'] and len(segments) == 3 and segments[2] in state.batches:
+            self.send_json(200, state.batches[segments[2]])
+        elif method == 'GET' and segments[:2] == ['v1', 'files'] and len(segments) == 4 and segments[2] in state.files:
+            data = state.files[segments[2]]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif method == 'POST' and segments == ['v1', 'chat', 'completions']:
+            request = self.read_json()
+            if request.get('stream'):
+                self.send_stream(state.complete(request))
+            else:
+                self.send_json(200, state.complete(request))
+        elif method == 'POST' and segments == ['v1', 'files']:
+            body = self.read_body()
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode('utf-8') + b'\r\n\r\n' + body)
+            file_id = state.new_id('file')
+            for part in message.iter_parts():
+                if part.get_filename():
+                    state.files[file_id] = part.get_payload(decode=True)
+            self.send_json(200, {'id': file_id, 'object': 'file', 'purpose': 'batch'})
+        elif method == 'POST' and segments == ['v1', 'batches']:
+            request = self.read_json()
+            batch_id = state.new_id('batch')
+            state.batches[batch_id] = {'id': batch_id,
+                                       'object': 'batch',
+                                       'status': 'in_progress',
+                                       'input_file_id': request['input_file_id'],
+                                       'endpoint': request['endpoint'],
+                                       'output_file_id': None}
+            threading.Thread(target=state.run_batch, args=(batch_id,), daemon=True).start()
+            self.send_json(200, state.batches[batch_id])
+        elif method == 'POST' and segments[:2] == ['v1', 'batches'] and segments[-1] == 'cancel' and segments[2] in state.batches:
+            state.batches[segments[2]]['status'] = 'cancelled'
+            self.send_json(200, state.batches[segments[2]])
+        else:
+            self.send_json(404, {'error': {'message': 'not found'}})
+
+def start(state, faults=None, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    return serve(OpenAIHandler, state, faults, host, port)
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat, files and batch endpoints")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--batch-delay', type=float, default=2.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--investigate-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    faults = Faults(failure_rate=args.failure_rate, throttle_rate=args.throttle_rate)
+    server = start(OpenAIState(args.latency, args.batch_delay, args.investigate_rate), faults, args.host, args.port)
+    logging.info("OpenAI stand-in listening on http://{0}:{1}/v1".format(args.host, server.server_port))
+    threading.Event().wait()
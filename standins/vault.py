@@ -0,0 +1,56 @@
+from standins.base import StandinHandler, Faults, serve
+from http.server import ThreadingHTTPServer
+import threading
+import argparse
+import logging
+
+class VaultState():
+    """ Unsealed Vault with a renewable token and KV v2 secrets for each backend """
+
+    def __init__(self, token='stand-in', ttl=86400, secrets=None):
+        self.token = token
+        self.ttl = ttl
+        self.secrets = secrets or {}
+        self.versions = {path: 1 for path in self.secrets}
+
+class VaultHandler(StandinHandler):
+
+    def route(self, method, segments, query) -> None:
+        state = self.state
+        if self.headers.get('X-Vault-Token') != state.token:
+            self.send_json(403, {'errors': ['permission denied']})
+            return
+        path = '/'.join(segments[1:])
+        if path == 'auth/token/lookup-self':
+            self.send_json(200, {'data': {'ttl': state.ttl, 'renewable': True}})
+        elif path == 'auth/token/renew-self':
+            self.send_json(200, {'auth': {'client_token': state.token, 'lease_duration': state.ttl, 'renewable': True}})
+        elif path == 'sys/seal-status':
+            self.send_json(200, {'sealed': False})
+        elif path in state.secrets:
+            self.send_json(200, {'data': {'data': state.secrets[path],
+                                          'metadata': {'version': state.versions[path],
+                                                       'created_time': '2025-01-01T00:00:00Z'}}})
+        else:
+            self.send_json(404, {'errors': []})
+
+def start(state, faults=None, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    return serve(VaultHandler, state, faults, host, port)
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Local stand-in for the HashiCorp Vault endpoints the bot uses")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8200)
+    parser.add_argument('--token', default='stand-in')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    secrets = {'secret/data/iris': {'token': 'iris'},
+               'secret/data/mattermost': {'key': 'mattermost'},
+               'secret/data/gpt': {'key': 'gpt'}}
+    server = start(VaultState(args.token, secrets=secrets), Faults(args.latency, failure_rate=args.failure_rate,
+                                                throttle_rate=args.throttle_rate), args.host, args.port)
+    logging.info("Vault stand-in listening on http://{0}:{1}".format(args.host, server.server_port))
+    threading.Event().wait()
@@ -0,0 +1,65 @@
+from methods import jsonstream
+import unittest
+import random
+import json
+
+def chunked(data, generator):
+    """ Split bytes at random boundaries, including inside numbers and multi-byte characters """
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = generator.randint(1, 12)
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+def random_value(generator, depth=0):
+    kind = generator.randrange(8 if depth < 3 else 5)
+    if kind == 0:
+        return generator.randint(-10 ** 6, 10 ** 6)
+    if kind == 1:
+        return generator.choice([1.5, -0.25, 1.5e3, 2.5e-7, 123456.789, 1e21])
+    if kind == 2:
+        return generator.choice([True, False, None])
+    if kind == 3:
+        return ''.join(generator.choice('ab"\\\n é✓') for _ in range(generator.randint(0, 8)))
+    if kind == 4:
+        return generator.choice(['', '1.5e3', 'true'])
+    if kind in (5, 6):
+        return {str(i): random_value(generator, depth + 1) for i in range(generator.randint(0, 4))}
+    return [random_value(generator, depth + 1) for _ in range(generator.randint(0, 4))]
+
+class IterArrayTests(unittest.TestCase):
+
+    def test_matches_json_loads_over_random_chunkings(self):
+        generator = random.Random(7)
+        for _ in range(300):
+            items = [random_value(generator) for _ in range(generator.randint(0, 6))]
+            document = {'before': random_value(generator), 'data': {'items': items, 'next_page': generator.randint(0, 9)}}
+            data = json.dumps(document, ensure_ascii=generator.random() < 0.5,
+                              indent=generator.choice([None, 1])).encode('utf-8')
+            expected = json.loads(data)
+            meta = {}
+            parsed = list(jsonstream.iter_array(chunked(data, generator), ['data', 'items'], meta))
+            self.assertEqual(parsed, expected['data']['items'])
+            self.assertEqual(meta['next_page'], expected['data']['next_page'])
+            self.assertEqual(meta['before'], expected['before'])
+
+    def test_numbers_split_at_chunk_boundaries(self):
+        for chunks in ([b'[1.', b'5, 2]'], [b'[1.5e', b'3]'], [b'[-', b'7]'], [b'[12', b'34]'], [b'[1', b'.', b'5]']):
+            self.assertEqual(list(jsonstream.iter_array([b'{"a": '] + chunks + [b'}'], ['a'])),
+                             json.loads(b''.join(chunks)))
+
+    def test_top_level_array(self):
+        self.assertEqual(list(jsonstream.iter_array([b'[1, ', b'{"b": 2}]'], [])), [1, {'b': 2}])
+
+    def test_missing_path(self):
+        with self.assertRaises(KeyError):
+            list(jsonstream.iter_array([b'{"data": {}}'], ['data', 'items']))
+
+    def test_truncated_stream(self):
+        with self.assertRaises(ValueError):
+            list(jsonstream.iter_array([b'{"data": [1, 2'], ['data']))
+
+if __name__ == '__main__':
+    unittest.main()